@@ -1,132 +1,52 @@
-import os, openai
-from dotenv import load_dotenv
-from products import products
-from flask import Flask, render_template, request, url_for
+# Flask app serving the pipeline of email_pipeline.py, run with: python app.py
+import json
+from flask import Flask, Response, render_template, request, stream_with_context, url_for
+import shared_modules
+from job_queue import job_queue
+from metrics import metrics
+from email_pipeline import run_email_pipeline, metric_gauges
 
 app = Flask(__name__)
 
-# Load environment variables for OpenAI API key
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")  # Set the API key
-
-# Define delimiter
-delimiter = "####"
-
-# Use text completion to generate the required content
-def get_completion_from_messages(messages, 
-                                 model="gpt-3.5-turbo", 
-                                 temperature=0, 
-                                 max_tokens=500):
-    response = openai.ChatCompletion.create( # type: ignore
-        model=model,
-        messages=messages,
-        temperature=temperature, 
-        max_tokens=max_tokens, 
-    )
-    return response.choices[0].message.content
-
-
-# Step 1: Generate customer comment based on the product input 
-def generate_customer_comment(products):
-
-    system_message = f"""{products}"""
-    user_message = f"""Generate comment in less than 100 words about the products"""
-
-    messages =  [ 
-    {'role':'system',
-    'content': system_message},
-    {'role':'user',
-    'content': f"{delimiter}Assume you are a customer of the electronics company. {user_message}{delimiter}"},   
-    ]
-
-    comment = get_completion_from_messages(messages)
-    print('Comment:\n', comment)
-    return comment
-
-
-# Step 2: Generate a subject for the email from the comment 
-def generate_email_subject(comment):
-    system_message = comment
-    user_message = f"""Please generate a subject for the email from the comment using Inferring technique."""
-
-    messages =  [  
-    {'role':'system',
-    'content': system_message},   
-    {'role':'user',
-    'content': f"{delimiter}Assume that you are a customer support representative of the electronics company. {user_message}{delimiter}"},  
-    ]
-
-    subject = get_completion_from_messages(messages)
-    print('Subject of the email:\n', subject)
-    return subject
-
-
-# Step 3: Create a summary of the comment
-def generate_summary(comment):
-    system_message = comment
-    user_message = f"""Provide a concise summary of the comment in at most 30 words."""
-
-    messages =  [  
-    {'role':'system',
-    'content': system_message},   
-    {'role':'user',
-    'content': f"{delimiter}Assume that you are a customer support representative of the electronics company. {user_message}{delimiter}"},    
-    ]
-
-    summary = get_completion_from_messages(messages)
-    print('Summary of the comment:\n', summary)
-    return summary
-
-
-# Step 4: Analyze the sentiment of the comment and tell if it is positive or negative
-def analyze_sentiment(comment):
-    system_message = comment
-    user_message = f"""Do sentiment analysis of the comment using Inferring technique. Just mention if it is positive or negative in one word."""
-
-    messages =  [  
-    {'role':'system',
-    'content': system_message},   
-    {'role':'user',
-    'content': f"{delimiter}Assume that you are a customer support representative of the electronics company. {user_message}{delimiter}"},    
-    ]
-
-    sentiment = get_completion_from_messages(messages)
-    print('Sentiment of the comment:\n', sentiment)
-    return sentiment
-
-
-# Translate the given content into the selected language
-def get_translation(email, language):
-    system_message = email
-    user_message = f"""Translate the given email content into {language} using Transforming technique"""
-
-    messages =  [  
-    {'role':'system', 
-    'content': system_message},    
-    {'role':'user', 
-    'content': f"{delimiter}{user_message}{delimiter}"},  
-    ]
-
-    translate = get_completion_from_messages(messages)
-    print(f"Translation of customer comment email in {language}: ")
-    print(translate,"\n")
-    return translate
-
-# Step 5: Generate email based on the comment, summary, sentiment and subject generated
-def generate_email(comment, subject, summary, sentiment):
-    system_message = comment + subject + summary + sentiment
-    user_message = f"""Create an email to be sent to the customer based on the {comment} and {sentiment}, including {subject}, {summary} in a proper format having subject and other content."""
-
-    messages =  [  
-    {'role':'system',
-    'content': system_message},   
-    {'role':'user',
-    'content': f"{delimiter}Assume that you are a customer support representative of the electronics company. {user_message}{delimiter}"},    
-    ]
+job_queue.register('email', lambda params, update: run_email_pipeline(params['language'], params['selected'], update))
+# Queued jobs left by a restart are picked up without waiting for a new one
+job_queue.start()
 
-    email = get_completion_from_messages(messages)
-    print('Email generated:\n', email)
-    return email
+
+# Server-sent event helper
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Start the pipeline as a background job, the page polls or streams its results
+@app.route("/jobs", methods=("POST",))
+def submit_job():
+    language = request.form.get("language", "en")
+    selected = [name for name in ('email', 'comment') if request.form.get(f"translate-{name}")]
+    job_id = job_queue.submit('email', {'language': language, 'selected': selected})
+    return {'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id),
+            'events_url': url_for('job_events', job_id=job_id)}, 202
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return {'error': "unknown job"}, 404
+    return job
+
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    events = (sse_event(event, data) for event, data in job_queue.events(job_id))
+    return Response(stream_with_context(events), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Prometheus metrics of the pipeline stages
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(metric_gauges()), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/", methods=("GET", "POST"))
@@ -137,19 +57,8 @@ def index():
 
     if request.method == "POST":
         language = request.form.get("language")
-        translate_comment = request.form.get("translate-comment")
-        translate_email = request.form.get("translate-email")
-        comment = generate_customer_comment(products)
-        subject = generate_email_subject(comment)
-        summary = generate_summary(comment)
-        sentiment = analyze_sentiment(comment)
-        email = generate_email(comment, subject, summary, sentiment)
-
-        if translate_email:
-            email = get_translation(email, language)
-
-        if translate_comment:
-            comment = get_translation(comment, language)
+        selected = [name for name in ('email', 'comment') if request.form.get(f"translate-{name}")]
+        comment, email = run_email_pipeline(language, selected)
     
     return render_template('index.html', comment = comment, language = language, email = email)
 
@@ -0,0 +1,169 @@
+# Async serving mode of the email app
+# Handlers await the OpenAI calls on the shared connection pool of llm_client,
+# so one process can serve many conversations at once.
+# Run with: hypercorn asgi_app:app --bind 0.0.0.0:3000
+import asyncio
+from quart import Quart, Response, render_template, request
+import shared_modules
+from completion_cache import completion_cache, CompletionCache
+from llm_client import acreate_chat_completion, aclose
+from metrics import metrics, timed_stage, record_usage, record_cache_hit
+from rate_limiter import rate_limiter, estimate_prompt_tokens
+from translation_service import translation_service
+from email_pipeline import (products, customer_comment_messages, email_subject_messages, summary_messages,
+                            sentiment_messages, email_messages, comment_analysis_messages,
+                            parse_comment_analysis, report_translations, sentiment_scorer,
+                            log_sentiment_label, email_stage_mode, metric_gauges)
+
+app = Quart(__name__)
+
+
+@app.after_serving
+async def close_connection_pool():
+    await aclose()
+
+
+async def get_completion_from_messages(messages,
+                                       model="gpt-3.5-turbo",
+                                       temperature=0,
+                                       max_tokens=500):
+    key = CompletionCache.make_key(model, messages, temperature, max_tokens)
+    if temperature == 0:
+        # The SQLite cache blocks, so it is read and written off the event loop
+        cached = await asyncio.to_thread(completion_cache.get, key)
+        if cached is not None:
+            record_cache_hit()
+            return cached
+
+    # Waits while the OPENAI_RPM or OPENAI_TPM budget is used up
+    reserved = await rate_limiter.acquire(estimate_prompt_tokens(messages) + max_tokens)
+    response = await acreate_chat_completion(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens
+    )
+    if response.usage is not None:
+        rate_limiter.settle(reserved, response.usage.total_tokens)
+    record_usage(response.usage)
+    content = response.choices[0].message.content
+    if temperature == 0 and content is not None:
+        await asyncio.to_thread(completion_cache.set, key, content)
+    return content
+
+
+@timed_stage("comment_generation")
+async def generate_customer_comment(products):
+    comment = await get_completion_from_messages(customer_comment_messages(products))
+    print('Comment:\n', comment)
+    return comment
+
+
+@timed_stage("subject")
+async def generate_email_subject(comment):
+    subject = await get_completion_from_messages(email_subject_messages(comment))
+    print('Subject of the email:\n', subject)
+    return subject
+
+
+@timed_stage("summary")
+async def generate_summary(comment):
+    summary = await get_completion_from_messages(summary_messages(comment))
+    print('Summary of the comment:\n', summary)
+    return summary
+
+
+# Background LLM labels of locally decided sentiments, referenced until they finish
+audit_tasks = set()
+
+
+@timed_stage("sentiment")
+async def analyze_sentiment(comment):
+    sentiment = sentiment_scorer.screen(comment)
+    if sentiment is None:
+        sentiment = await get_completion_from_messages(sentiment_messages(comment))
+        log_sentiment_label(comment, sentiment)
+    elif sentiment_scorer.audit():
+        task = asyncio.create_task(audit_sentiment(comment, sentiment))
+        audit_tasks.add(task)
+        task.add_done_callback(audit_tasks.discard)
+    print('Sentiment of the comment:\n', sentiment)
+    return sentiment
+
+
+async def audit_sentiment(comment, local):
+    log_sentiment_label(comment, await get_completion_from_messages(sentiment_messages(comment)), local)
+
+
+@timed_stage("comment_analysis")
+async def analyze_comment(comment):
+    return parse_comment_analysis(await get_completion_from_messages(comment_analysis_messages(comment)))
+
+
+async def generate_email_parts(comment, mode=email_stage_mode):
+    if mode == "fused":
+        parts = await analyze_comment(comment)
+        if parts is not None:
+            return parts
+        print("Fused comment analysis failed, running the stages separately")
+        mode = "concurrent"
+
+    stages = (generate_email_subject, generate_summary, analyze_sentiment)
+    if mode == "concurrent":
+        return tuple(await asyncio.gather(*[stage(comment) for stage in stages]))
+    return tuple([await stage(comment) for stage in stages])
+
+
+@timed_stage("translation")
+async def get_translations(texts, language):
+    translations = await translation_service.atranslate(texts, [language], get_completion_from_messages)
+    translations = [translation[language] for translation in translations]
+    print(f"Translation of customer comment email in {language}: ")
+    print(*translations, sep="\n\n")
+    return translations
+
+
+@timed_stage("email_generation")
+async def generate_email(comment, subject, summary, sentiment):
+    email = await get_completion_from_messages(email_messages(comment, subject, summary, sentiment))
+    print('Email generated:\n', email)
+    return email
+
+
+async def run_email_pipeline(language, selected, update=None):
+    """Async version of email_pipeline.run_email_pipeline."""
+    update = update or (lambda key, value: None)
+    comment = await generate_customer_comment(products)
+    update('comment', comment)
+    subject, summary, sentiment = await generate_email_parts(comment)
+    update('subject', subject)
+    update('summary', summary)
+    update('sentiment', sentiment)
+    email = await generate_email(comment, subject, summary, sentiment)
+    update('email', email)
+
+    texts = {'email': email, 'comment': comment}
+    if selected:
+        report_translations(texts, selected, await get_translations([texts[name] for name in selected], language),
+                            update)
+    return texts['comment'], texts['email']
+
+
+@app.route("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.render(metric_gauges()), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/", methods=("GET", "POST"))
+async def index():
+    comment = None
+    language = 'en'
+    email = None
+
+    if request.method == "POST":
+        form = await request.form
+        language = form.get("language")
+        selected = [name for name in ('email', 'comment') if form.get(f"translate-{name}")]
+        comment, email = await run_email_pipeline(language, selected)
+
+    return await render_template('index.html', comment=comment, language=language, email=email)
@@ -0,0 +1,56 @@
+# Benchmark of the serial, concurrent and fused email stage modes
+# Run with: python email_benchmark.py [runs]
+import os, statistics, sys, time
+
+# The completion cache is cleared before every run, so it gets its own file
+os.environ.setdefault("COMPLETION_CACHE_FILE", "./data/benchmark_cache.sqlite3")
+
+from email_pipeline import (products, completion_cache, email_stage_modes, generate_customer_comment,
+                            generate_email_parts, generate_email)
+import shared_modules
+from metrics import metrics
+
+
+def usage_totals():
+    """LLM calls and tokens recorded so far over all stages."""
+    with metrics.lock:
+        return (sum(metrics.llm_calls.values()),
+                sum(histogram.sum for histogram in metrics.prompt_tokens.values()),
+                sum(histogram.sum for histogram in metrics.completion_tokens.values()))
+
+
+def benchmark(comment, mode, runs):
+    """Wall time of the parts and the email for the comment, with an empty cache every run."""
+    seconds = []
+    before = usage_totals()
+    for _ in range(runs):
+        completion_cache.clear()
+        started = time.perf_counter()
+        subject, summary, sentiment = generate_email_parts(comment, mode)
+        generate_email(comment, subject, summary, sentiment)
+        seconds.append(time.perf_counter() - started)
+    after = usage_totals()
+    calls, prompt_tokens, completion_tokens = (b - a for a, b in zip(before, after))
+    return {
+        'mean': statistics.mean(seconds),
+        'median': statistics.median(seconds),
+        'max': max(seconds),
+        'calls': calls / runs,
+        'prompt_tokens': prompt_tokens / runs,
+        'completion_tokens': completion_tokens / runs,
+    }
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    comment = generate_customer_comment(products)
+    results = {mode: benchmark(comment, mode, runs) for mode in email_stage_modes}
+
+    print(f"\nSubject, summary, sentiment and email over {runs} runs per mode:")
+    print(f"{'mode':<12}{'mean s':>9}{'median s':>10}{'max s':>8}{'calls':>7}{'prompt tok':>12}{'compl tok':>11}")
+    for mode, result in results.items():
+        print(f"{mode:<12}{result['mean']:>9.2f}{result['median']:>10.2f}{result['max']:>8.2f}{result['calls']:>7.1f}"
+              f"{result['prompt_tokens']:>12.0f}{result['completion_tokens']:>11.0f}")
+    serial = results['serial']['mean']
+    for mode in email_stage_modes[1:]:
+        print(f"{mode} is {serial / results[mode]['mean']:.2f}x as fast as serial")
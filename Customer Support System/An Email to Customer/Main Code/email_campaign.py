@@ -0,0 +1,132 @@
+# Answers customer comments in bulk with the email pipeline of the async app
+# Run with: python email_campaign.py <comments.csv|comments.jsonl> <results.jsonl> [language]
+# CSV files need a "comment" column, JSONL lines a "comment" field. An "id" and
+# a "language" column or field are optional.
+import asyncio, csv, hashlib, json, os, sys, time
+from asgi_app import generate_email_parts, generate_email, get_translations, audit_tasks
+import shared_modules
+from llm_client import aclose
+from rate_limiter import rate_limiter
+
+# Comments processed at the same time, the rate limiter decides how fast requests go out
+campaign_workers = int(os.getenv("CAMPAIGN_WORKERS", "8"))
+
+
+def comment_id(record):
+    if record.get('id'):
+        return str(record['id'])
+    return hashlib.sha256(record['comment'].encode("utf-8")).hexdigest()[:16]
+
+
+def read_comments(path):
+    """Comment records of the CSV or JSONL file, read one at a time."""
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        if path.endswith(".csv"):
+            records = csv.DictReader(file)
+        else:
+            records = (json.loads(line) for line in file if line.strip())
+        for record in records:
+            if record.get('comment'):
+                yield dict(record, id=comment_id(record))
+
+
+def finished_ids(path):
+    """Ids with an email in the results file. A line cut off by a crash is ignored."""
+    ids = set()
+    if not os.path.exists(path):
+        return ids
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if result.get('email'):
+                ids.add(result['id'])
+    return ids
+
+
+def end_partial_line(path):
+    """A crash can leave the last line cut off, the next result must start on a new line."""
+    if os.path.exists(path) and os.path.getsize(path):
+        with open(path, 'rb+') as file:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b"\n":
+                file.write(b"\n")
+
+
+def append_result(path, result):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+async def answer_comment(record, language):
+    comment = record['comment']
+    subject, summary, sentiment = await generate_email_parts(comment)
+    email = await generate_email(comment, subject, summary, sentiment)
+    result = {'id': record['id'], 'comment': comment, 'subject': subject, 'summary': summary,
+              'sentiment': sentiment, 'email': email}
+    language = record.get('language') or language
+    if language and language != 'en':
+        result['language'] = language
+        result['translated_email'] = (await get_translations([email], language))[0]
+    return result
+
+
+async def run_campaign(comments, results, language=None, workers=campaign_workers):
+    """
+    Answers every comment that has no email in the results file yet. Each
+    result is appended as soon as it is done, so a crashed or interrupted
+    campaign is resumed by running the same command again.
+    """
+    done = finished_ids(results)
+    end_partial_line(results)
+    queue = asyncio.Queue(maxsize=2 * workers)
+    counts = {'answered': 0, 'failed': 0, 'skipped': 0}
+    started = time.perf_counter()
+
+    async def worker():
+        while True:
+            record = await queue.get()
+            if record is None:
+                return
+            try:
+                result = await answer_comment(record, language)
+                counts['answered'] += 1
+            except Exception as exception:
+                result = {'id': record['id'], 'comment': record['comment'],
+                          'error': f"{type(exception).__name__}: {exception}"}
+                counts['failed'] += 1
+            append_result(results, result)
+            if (counts['answered'] + counts['failed']) % 50 == 0:
+                print(f"Answered {counts['answered']} comments, {counts['failed']} failed")
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        for record in read_comments(comments):
+            if record['id'] in done:
+                counts['skipped'] += 1
+                continue
+            # Blocks while the workers are busy, so the file is never read ahead
+            await queue.put(record)
+            done.add(record['id'])
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    finally:
+        # Sentiment audits still running in the background need the connection pool
+        await asyncio.gather(*audit_tasks, return_exceptions=True)
+        await aclose()
+
+    print(f"Answered {counts['answered']} comments, {counts['failed']} failed, {counts['skipped']} already done, "
+          f"{time.perf_counter() - started:.1f}s ({rate_limiter.waited:.1f}s waiting for the rate limits)")
+    return counts
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit("usage: python email_campaign.py <comments.csv|comments.jsonl> <results.jsonl> [language]")
+    asyncio.run(run_campaign(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None))
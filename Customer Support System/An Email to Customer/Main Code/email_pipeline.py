@@ -0,0 +1,262 @@
+# The comment and email pipeline of the email app, without a web server
+# app.py serves it with Flask, asgi_app.py and email_campaign.py share its prompts and parsers
+import os, openai, json
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import shared_modules
+from completion_cache import cached_completion, completion_cache
+from job_queue import job_queue
+from llm_client import create_chat_completion
+from metrics import timed_stage, record_usage, record_cache_hit
+from products import products
+from sentiment_scorer import sentiment_scorer, log_label as log_sentiment_label
+from translation_service import translation_service, translation_cache
+
+# Load environment variables for OpenAI API key
+load_dotenv()
+openai.api_key = os.getenv("OPENAI_API_KEY")  # Set the API key
+
+# Define delimiter
+delimiter = "####"
+
+# How the subject, summary and sentiment are inferred from the comment:
+# serial     - three requests one after another
+# concurrent - the same three requests at the same time
+# fused      - one request returning all three as json
+email_stage_mode = os.getenv("EMAIL_STAGE_MODE", "concurrent").lower()
+email_stage_modes = ("serial", "concurrent", "fused")
+if email_stage_mode not in email_stage_modes:
+    raise ValueError(f"EMAIL_STAGE_MODE must be one of {', '.join(email_stage_modes)}, not {email_stage_mode}")
+
+# Worker pool for the concurrent inference stages
+stage_executor = ThreadPoolExecutor(max_workers=int(os.getenv("EMAIL_STAGE_WORKERS", "12")))
+
+# Use text completion to generate the required content
+def get_completion_from_messages(messages, 
+                                 model="gpt-3.5-turbo", 
+                                 temperature=0, 
+                                 max_tokens=500):
+    def create():
+        response = create_chat_completion(
+            model=model,
+            messages=messages,
+            temperature=temperature, 
+            max_tokens=max_tokens, 
+        )
+        record_usage(response.usage)
+        return response.choices[0].message.content
+
+    # Repeated deterministic requests are served from the completion cache
+    return cached_completion(create, messages, model, temperature, max_tokens,
+                             on_hit=record_cache_hit)
+
+
+# Step 1: Generate customer comment based on the product input 
+def customer_comment_messages(products):
+
+    system_message = f"""{products}"""
+    user_message = f"""Generate comment in less than 100 words about the products"""
+
+    messages =  [ 
+    {'role':'system',
+    'content': system_message},
+    {'role':'user',
+    'content': f"{delimiter}Assume you are a customer of the electronics company. {user_message}{delimiter}"},   
+    ]
+
+    return messages
+
+@timed_stage("comment_generation")
+def generate_customer_comment(products):
+    comment = get_completion_from_messages(customer_comment_messages(products))
+    print('Comment:\n', comment)
+    return comment
+
+
+# Step 2: Generate a subject for the email from the comment 
+def email_subject_messages(comment):
+    system_message = comment
+    user_message = f"""Please generate a subject for the email from the comment using Inferring technique."""
+
+    messages =  [  
+    {'role':'system',
+    'content': system_message},   
+    {'role':'user',
+    'content': f"{delimiter}Assume that you are a customer support representative of the electronics company. {user_message}{delimiter}"},  
+    ]
+
+    return messages
+
+@timed_stage("subject")
+def generate_email_subject(comment):
+    subject = get_completion_from_messages(email_subject_messages(comment))
+    print('Subject of the email:\n', subject)
+    return subject
+
+
+# Step 3: Create a summary of the comment
+def summary_messages(comment):
+    system_message = comment
+    user_message = f"""Provide a concise summary of the comment in at most 30 words."""
+
+    messages =  [  
+    {'role':'system',
+    'content': system_message},   
+    {'role':'user',
+    'content': f"{delimiter}Assume that you are a customer support representative of the electronics company. {user_message}{delimiter}"},    
+    ]
+
+    return messages
+
+@timed_stage("summary")
+def generate_summary(comment):
+    summary = get_completion_from_messages(summary_messages(comment))
+    print('Summary of the comment:\n', summary)
+    return summary
+
+
+# Step 4: Analyze the sentiment of the comment and tell if it is positive or negative
+def sentiment_messages(comment):
+    system_message = comment
+    user_message = f"""Do sentiment analysis of the comment using Inferring technique. Just mention if it is positive or negative in one word."""
+
+    messages =  [  
+    {'role':'system',
+    'content': system_message},   
+    {'role':'user',
+    'content': f"{delimiter}Assume that you are a customer support representative of the electronics company. {user_message}{delimiter}"},    
+    ]
+
+    return messages
+
+@timed_stage("sentiment")
+def analyze_sentiment(comment):
+    # Clear cases are decided by the local lexicon scorer without an LLM call
+    sentiment = sentiment_scorer.screen(comment)
+    if sentiment is None:
+        sentiment = get_completion_from_messages(sentiment_messages(comment))
+        log_sentiment_label(comment, sentiment)
+    elif sentiment_scorer.audit():
+        # A few local decisions are labeled by the LLM in the background for calibration
+        stage_executor.submit(audit_sentiment, comment, sentiment)
+    print('Sentiment of the comment:\n', sentiment)
+    return sentiment
+
+def audit_sentiment(comment, local):
+    log_sentiment_label(comment, get_completion_from_messages(sentiment_messages(comment)), local)
+
+
+# Steps 2 to 4 in one request: subject, summary and sentiment as one json object
+def comment_analysis_messages(comment):
+    system_message = comment
+    user_message = f"""Using Inferring technique, generate a subject for the email from the comment, \
+provide a concise summary of the comment in at most 30 words and mention if its sentiment is positive or negative in one word. \
+Respond only with a json object with the keys "subject", "summary" and "sentiment"."""
+
+    messages =  [  
+    {'role':'system',
+    'content': system_message},   
+    {'role':'user',
+    'content': f"{delimiter}Assume that you are a customer support representative of the electronics company. {user_message}{delimiter}"},    
+    ]
+
+    return messages
+
+def parse_comment_analysis(response):
+    """(subject, summary, sentiment) of the json answer, or None when a part is missing."""
+    try:
+        data = json.loads(response[response.index("{"):response.rindex("}") + 1])
+    except (ValueError, AttributeError):
+        return None
+    parts = tuple(data.get(key) if isinstance(data, dict) else None for key in ('subject', 'summary', 'sentiment'))
+    if not all(isinstance(part, str) and part.strip() for part in parts):
+        return None
+    return parts
+
+@timed_stage("comment_analysis")
+def analyze_comment(comment):
+    return parse_comment_analysis(get_completion_from_messages(comment_analysis_messages(comment)))
+
+def generate_email_parts(comment, mode=email_stage_mode):
+    """Subject, summary and sentiment of the comment, inferred in the given mode."""
+    if mode == "fused":
+        parts = analyze_comment(comment)
+        if parts is not None:
+            print('Subject, summary and sentiment of the comment:\n', *parts, sep='\n')
+            return parts
+        # Malformed json answer, infer the parts with their own prompts instead
+        print("Fused comment analysis failed, running the stages separately")
+        mode = "concurrent"
+
+    stages = (generate_email_subject, generate_summary, analyze_sentiment)
+    if mode == "concurrent":
+        futures = [stage_executor.submit(stage, comment) for stage in stages]
+        return tuple(future.result() for future in futures)
+    return tuple(stage(comment) for stage in stages)
+
+
+# Translate the given contents into the selected language in one request
+@timed_stage("translation")
+def get_translations(texts, language):
+    translations = translation_service.translate(texts, [language], get_completion_from_messages)
+    translations = [translation[language] for translation in translations]
+    print(f"Translation of customer comment email in {language}: ")
+    print(*translations, sep="\n\n")
+    return translations
+
+# Step 5: Generate email based on the comment, summary, sentiment and subject generated
+def email_messages(comment, subject, summary, sentiment):
+    system_message = comment + subject + summary + sentiment
+    user_message = f"""Create an email to be sent to the customer based on the {comment} and {sentiment}, including {subject}, {summary} in a proper format having subject and other content."""
+
+    messages =  [  
+    {'role':'system',
+    'content': system_message},   
+    {'role':'user',
+    'content': f"{delimiter}Assume that you are a customer support representative of the electronics company. {user_message}{delimiter}"},    
+    ]
+
+    return messages
+
+@timed_stage("email_generation")
+def generate_email(comment, subject, summary, sentiment):
+    email = get_completion_from_messages(email_messages(comment, subject, summary, sentiment))
+    print('Email generated:\n', email)
+    return email
+
+
+# Run the whole pipeline, reporting each result to update(key, value) as soon as it is ready
+def run_email_pipeline(language, selected, update=None):
+    update = update or (lambda key, value: None)
+    comment = generate_customer_comment(products)
+    update('comment', comment)
+    subject, summary, sentiment = generate_email_parts(comment)
+    update('subject', subject)
+    update('summary', summary)
+    update('sentiment', sentiment)
+    email = generate_email(comment, subject, summary, sentiment)
+    update('email', email)
+
+    # The email and the comment are translated together
+    texts = {'email': email, 'comment': comment}
+    if selected:
+        report_translations(texts, selected, get_translations([texts[name] for name in selected], language), update)
+    return texts['comment'], texts['email']
+
+def report_translations(texts, selected, translations, update):
+    """Replace the selected texts with their translations, shared with the async pipeline."""
+    for name, translation in zip(selected, translations):
+        texts[name] = translation
+        update(name, translation)
+
+
+# Gauges of the caches and queues for the /metrics endpoint of both servers
+def metric_gauges():
+    cache_stats = completion_cache.stats()
+    return {
+        'completion_cache_hits': cache_stats['hits'],
+        'completion_cache_misses': cache_stats['misses'],
+        'translation_cache_hits': translation_cache.stats()['hits'],
+        'sentiment_escalation_rate': sentiment_scorer.stats()['escalation_rate'],
+        'jobs_queued': job_queue.stats()['queued'],
+    }
@@ -0,0 +1,85 @@
+# Token bucket rate limiter for the requests-per-minute and tokens-per-minute limits of the API
+import asyncio, os, time
+import shared_modules
+from token_count import message_tokens
+
+# Limits of the account, 0 turns a limit off. The defaults stay well below the
+# lowest paid tier, set the limits of your account to go faster.
+requests_per_minute = int(os.getenv("OPENAI_RPM", "500"))
+tokens_per_minute = int(os.getenv("OPENAI_TPM", "60000"))
+
+
+def estimate_prompt_tokens(messages):
+    return message_tokens(messages)
+
+
+class TokenBucket:
+    """Holds up to per_minute units and refills at per_minute / 60 units per second."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self.refill()
+        return max(0.0, (min(amount, self.capacity) - self.available) / self.rate)
+
+    def take(self, amount):
+        self.available -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        self.refill()
+        self.available = min(self.capacity, self.available + amount)
+
+
+class RateLimiter:
+    """
+    Waits until a request and its tokens fit into both buckets. Requests
+    are admitted in arrival order, so a large request is not starved by
+    small ones. The API counts max_tokens against the token limit, so
+    callers reserve prompt plus max_tokens and give back what was unused.
+    """
+
+    def __init__(self, requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute):
+        self.lock = None
+        self.configure(requests_per_minute, tokens_per_minute)
+
+    def configure(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.waited = 0.0
+
+    async def acquire(self, tokens):
+        """Reserve one request and the estimated tokens, returns the reserved tokens."""
+        if self.requests is None and self.tokens is None:
+            return 0
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            while True:
+                wait = max(self.requests.wait_time(1) if self.requests else 0.0,
+                           self.tokens.wait_time(tokens) if self.tokens else 0.0)
+                if wait <= 0:
+                    break
+                self.waited += wait
+                await asyncio.sleep(wait)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+        return tokens
+
+    def settle(self, reserved, used):
+        """Give back the reserved tokens the request did not use."""
+        if self.tokens and reserved > used:
+            self.tokens.give_back(reserved - used)
+
+
+rate_limiter = RateLimiter()
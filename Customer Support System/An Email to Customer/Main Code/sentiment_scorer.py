@@ -0,0 +1,198 @@
+# Local lexicon sentiment scorer that runs before the LLM sentiment analysis
+# Compare its scores with the logged LLM labels with: python sentiment_scorer.py calibrate
+import json, math, os, random, re, sys, threading
+
+labels_file = "./data/sentiment_labels.jsonl"
+
+# Compound scores at or above positive_above are positive, at or below
+# negative_below negative, anything in between goes to the LLM
+positive_above = float(os.getenv("SENTIMENT_POSITIVE_ABOVE", "0.6"))
+negative_below = float(os.getenv("SENTIMENT_NEGATIVE_BELOW", "-0.6"))
+
+# Fraction of the locally decided comments that still get an LLM label, for calibration
+audit_rate = float(os.getenv("SENTIMENT_AUDIT_RATE", "0.02"))
+
+# Word weights, common words of product reviews
+lexicon = {
+    # positive
+    "love": 3.0, "loved": 3.0, "loving": 2.5, "amazing": 3.0, "awesome": 3.0, "excellent": 3.0,
+    "fantastic": 3.0, "perfect": 3.0, "outstanding": 3.0, "superb": 3.0, "incredible": 2.5,
+    "great": 2.5, "impressed": 2.5, "impressive": 2.5, "wonderful": 2.5, "brilliant": 2.5,
+    "happy": 2.0, "pleased": 2.0, "satisfied": 2.0, "recommend": 2.0, "recommended": 2.0,
+    "good": 1.8, "nice": 1.8, "reliable": 1.8, "stunning": 2.5, "beautiful": 2.0, "sleek": 1.5,
+    "fast": 1.2, "smooth": 1.5, "easy": 1.2, "powerful": 1.5, "crisp": 1.5, "vibrant": 1.5,
+    "comfortable": 1.5, "solid": 1.2, "worth": 1.5, "value": 1.0, "affordable": 1.2, "enjoy": 2.0,
+    "enjoyed": 2.0, "helpful": 1.8, "seamless": 1.8, "immersive": 1.5, "best": 2.5, "thanks": 1.5,
+    "thank": 1.5, "glad": 2.0, "delighted": 3.0, "exceeded": 2.5, "flawless": 3.0, "lightweight": 1.0,
+    # negative
+    "hate": -3.0, "hated": -3.0, "terrible": -3.0, "awful": -3.0, "horrible": -3.0, "worst": -3.0,
+    "useless": -3.0, "broken": -2.5, "broke": -2.5, "defective": -3.0, "disappointed": -2.5,
+    "disappointing": -2.5, "disappointment": -2.5, "poor": -2.0, "bad": -2.5, "faulty": -2.5,
+    "refund": -2.0, "return": -1.0, "returned": -2.0, "waste": -2.5, "wasted": -2.5, "slow": -1.5,
+    "overpriced": -2.0, "expensive": -1.0, "cheap": -1.0, "flimsy": -2.0, "noisy": -1.5,
+    "annoying": -2.0, "frustrating": -2.5, "frustrated": -2.5, "issue": -1.2, "issues": -1.2,
+    "problem": -1.5, "problems": -1.5, "crash": -2.0, "crashes": -2.0, "freezes": -2.0,
+    "stopped": -1.5, "fails": -2.0, "failed": -2.0, "unhappy": -2.5, "angry": -2.5, "lag": -1.5,
+    "laggy": -2.0, "overheats": -2.0, "overheating": -2.0, "unreliable": -2.5, "complaint": -2.0,
+    "mediocre": -1.5, "unfortunately": -1.5, "regret": -2.5, "dead": -2.0, "damaged": -2.5,
+}
+
+negations = {"not", "no", "never", "without", "hardly", "barely", "nothing", "neither", "nor"}
+intensifiers = {"very": 1.3, "really": 1.3, "extremely": 1.5, "so": 1.2, "super": 1.3,
+                "absolutely": 1.5, "incredibly": 1.5, "truly": 1.3, "quite": 1.1, "highly": 1.4}
+# Words after these count more than the words before them ("good, but it broke")
+contrasts = {"but", "however", "although", "though", "yet"}
+
+# Normalization of the summed weights into (-1, 1)
+alpha = 15
+
+
+def tokenize(text):
+    # "isn't" becomes "is not" so the negation is seen
+    text = re.sub(r"n't\b", " not", text.lower())
+    return re.findall(r"[a-z]+", text)
+
+
+def normalize_label(response):
+    """'positive', 'negative' or None for an LLM answer such as "Positive."."""
+    words = tokenize(response or "")
+    for label in ("positive", "negative"):
+        if label in words:
+            return label
+    return None
+
+
+class SentimentScorer:
+    """
+    Sums lexicon weights with negation, intensifier and contrast rules
+    into a compound score in (-1, 1). Clear scores are decided locally,
+    mixed and weak ones are escalated to the LLM.
+    """
+
+    def __init__(self, positive_above=positive_above, negative_below=negative_below, audit_rate=audit_rate):
+        self.positive_above = positive_above
+        self.negative_below = negative_below
+        self.audit_rate = audit_rate
+        self.lock = threading.Lock()
+        self.counts = {'positive': 0, 'negative': 0, 'escalated': 0}
+
+    def evidence(self, text):
+        """Summed positive and negative weights of the text."""
+        tokens = tokenize(text)
+        weights = []
+        for i, token in enumerate(tokens):
+            weight = lexicon.get(token)
+            if weight is None:
+                continue
+            before = tokens[max(0, i - 3):i]
+            if before and before[-1] in intensifiers:
+                weight *= intensifiers[before[-1]]
+            if any(word in negations for word in before):
+                weight *= -0.75
+            weights.append((i, weight))
+
+        last_contrast = max((i for i, token in enumerate(tokens) if token in contrasts), default=-1)
+        positive = negative = 0.0
+        for i, weight in weights:
+            if last_contrast >= 0:
+                weight *= 1.5 if i > last_contrast else 0.5
+            if weight > 0:
+                positive += weight
+            else:
+                negative -= weight
+        return positive, negative
+
+    def score(self, text):
+        positive, negative = self.evidence(text)
+        total = positive - negative
+        return total / math.sqrt(total * total + alpha)
+
+    def mixed(self, text):
+        positive, negative = self.evidence(text)
+        return min(positive, negative) >= 0.5 * max(positive, negative) > 0
+
+    def screen(self, text):
+        """'Positive' or 'Negative' when the score is clear, None to escalate to the LLM."""
+        score = self.score(text)
+        if self.mixed(text):
+            verdict, outcome = None, 'escalated'
+        elif score >= self.positive_above:
+            verdict, outcome = 'Positive', 'positive'
+        elif score <= self.negative_below:
+            verdict, outcome = 'Negative', 'negative'
+        else:
+            verdict, outcome = None, 'escalated'
+        with self.lock:
+            self.counts[outcome] += 1
+        print(f"\nSentiment score {score:.2f}: {outcome} (escalation rate {self.escalation_rate():.1%})")
+        return verdict
+
+    def audit(self):
+        """Whether a locally decided comment should also be labeled by the LLM."""
+        return random.random() < self.audit_rate
+
+    def escalation_rate(self):
+        total = sum(self.counts.values())
+        return self.counts['escalated'] / total if total else 0.0
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, escalation_rate=self.escalation_rate())
+
+
+def log_label(text, response, local=None):
+    """Keep the LLM label with the local verdict for the calibration report."""
+    label = normalize_label(response)
+    if label is None:
+        return
+    directory = os.path.dirname(labels_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(labels_file, 'a', encoding='utf-8') as file:
+        file.write(json.dumps({'comment': text, 'label': label, 'local': local}) + "\n")
+
+
+def calibrate(path=labels_file, scorer=None):
+    """
+    Agreement of the scores with the LLM labels per score bucket, and the
+    coverage and accuracy of the local decisions at the current thresholds.
+    """
+    scorer = scorer or sentiment_scorer
+    if not os.path.exists(path):
+        print(f"No labels found in {path}")
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        records = [json.loads(line) for line in file if line.strip()]
+
+    buckets = {}
+    decided = correct = 0
+    for record in records:
+        score = scorer.score(record['comment'])
+        bucket = min(int((score + 1) * 5), 9)
+        counts = buckets.setdefault(bucket, [0, 0])
+        counts[0] += 1
+        counts[1] += record['label'] == 'positive'
+        if not scorer.mixed(record['comment']) and (score >= scorer.positive_above or score <= scorer.negative_below):
+            decided += 1
+            correct += (score > 0) == (record['label'] == 'positive')
+
+    print(f"{len(records)} LLM labels in {path}")
+    print(f"{'score':<14}{'comments':>9}{'LLM positive':>14}")
+    for bucket in sorted(buckets):
+        total, positive = buckets[bucket]
+        low = bucket / 5 - 1
+        print(f"{low:>5.1f} to {low + 0.2:>4.1f}{total:>9}{positive / total:>14.1%}")
+    coverage = decided / len(records) if records else 0.0
+    accuracy = correct / decided if decided else 0.0
+    print(f"Thresholds {scorer.negative_below} / {scorer.positive_above}: {coverage:.1%} decided locally, "
+          f"{accuracy:.1%} of them agree with the LLM")
+    return {'labels': len(records), 'coverage': coverage, 'accuracy': accuracy}
+
+
+sentiment_scorer = SentimentScorer()
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'calibrate':
+        calibrate(sys.argv[2] if len(sys.argv) > 2 else labels_file)
+    else:
+        print("Usage: python sentiment_scorer.py calibrate [labels file]")
@@ -0,0 +1,7 @@
+# The modules used by both apps are kept once in Customer Support System/shared,
+# importing this module makes them importable from the app directory
+import os, sys
+
+shared_directory = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "shared"))
+if shared_directory not in sys.path:
+    sys.path.append(shared_directory)
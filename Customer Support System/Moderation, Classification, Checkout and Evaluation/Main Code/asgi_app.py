@@ -0,0 +1,303 @@
+# Async serving mode of the support app
+# Handlers await the OpenAI calls on the shared connection pool of llm_client,
+# so one process can serve many conversations at once.
+# Run with: hypercorn asgi_app:app --bind 0.0.0.0:5000
+import asyncio
+from quart import Quart, Response, render_template, request
+from catalog import catalog
+from comment_pool import comment_pool
+import shared_modules
+from completion_cache import completion_cache, CompletionCache
+from llm_client import acreate_chat_completion, aclose
+from metrics import metrics, timed_stage, record_usage, record_cache_hit
+from prompt_budget import prompt_budget, PromptTooLarge
+from translation_service import translation_service
+from support_pipeline import (speculative_answer, blocking_results, blocked_answer, too_large_answer,
+                              sse_event, QuestionRun, AnswerStream, customer_comment_messages,
+                              moderation_result, moderation_batcher, prompt_injection_messages,
+                              prompt_injection_result, injection_prefilter, log_injection_verdict,
+                              request_classifier, classification_messages, classification_result,
+                              chain_of_thought_messages, output_check_prompt, output_check_result,
+                              metric_gauges)
+
+app = Quart(__name__)
+
+
+@app.after_serving
+async def close_connection_pool():
+    await aclose()
+
+
+async def get_completion_from_messages(messages,
+                                       model="gpt-3.5-turbo",
+                                       temperature=0,
+                                       max_tokens=2000):
+    prompt_budget.check(messages)
+    key = CompletionCache.make_key(model, messages, temperature, max_tokens)
+    if temperature == 0:
+        # The SQLite cache blocks, so it is read and written off the event loop
+        cached = await asyncio.to_thread(completion_cache.get, key)
+        if cached is not None:
+            record_cache_hit()
+            return cached
+
+    response = await acreate_chat_completion(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens
+    )
+    record_usage(response.usage)
+    content = response.choices[0].message.content
+    if temperature == 0 and content is not None:
+        await asyncio.to_thread(completion_cache.set, key, content)
+    return content
+
+
+async def stream_completion_from_messages(messages,
+                                          model="gpt-3.5-turbo",
+                                          temperature=0,
+                                          max_tokens=2000):
+    prompt_budget.check(messages)
+    key = CompletionCache.make_key(model, messages, temperature, max_tokens)
+    if temperature == 0:
+        cached = await asyncio.to_thread(completion_cache.get, key)
+        if cached is not None:
+            record_cache_hit()
+            yield cached
+            return
+
+    stream = await acreate_chat_completion(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    parts = []
+    async for chunk in stream:
+        if chunk.usage is not None:
+            record_usage(chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+
+    if temperature == 0:
+        await asyncio.to_thread(completion_cache.set, key, "".join(parts))
+
+
+@timed_stage("comment_generation")
+async def generate_customer_comment(product):
+    return await get_completion_from_messages(customer_comment_messages(product))
+
+
+@timed_stage("translation")
+async def get_translation(comment, language):
+    translations = await translation_service.atranslate([comment], [language], get_completion_from_messages)
+    return translations[0][language]
+
+
+@timed_stage("moderation")
+async def check_moderation(message):
+    print("\nStep 1.1: Check inappropriate prompts")
+    result = await asyncio.wrap_future(moderation_batcher.submit(message))
+    return moderation_result(result)
+
+
+# Background LLM checks of local decisions, referenced until they finish
+audit_tasks = set()
+
+
+@timed_stage("prompt_injection")
+async def verify_prompt_injection(question, language):
+    print("\nStep 1.2: Prevent Prompt Injection")
+    response = injection_prefilter.screen(question)
+    if response is None:
+        response = await get_completion_from_messages(prompt_injection_messages(question, language),
+                max_tokens=1)
+        log_injection_verdict(question, response)
+    elif injection_prefilter.audit():
+        task = asyncio.create_task(audit_prompt_injection(question, language, response))
+        audit_tasks.add(task)
+        task.add_done_callback(audit_tasks.discard)
+    return prompt_injection_result(response)
+
+
+async def audit_prompt_injection(question, language, local):
+    response = await get_completion_from_messages(prompt_injection_messages(question, language), max_tokens=1)
+    log_injection_verdict(question, response, local)
+
+
+@timed_stage("classification")
+async def service_request_classification(question):
+    print("\n# Step 2: Classification of Service Requests")
+    classification = request_classifier.classify(question)
+    if classification is not None:
+        classification['source'] = 'local'
+        return classification
+    response = await get_completion_from_messages(classification_messages(question))
+    return classification_result(question, response)
+
+
+@timed_stage("cot_answer")
+async def chain_of_thought_reasoning(question):
+    response = await get_completion_from_messages(chain_of_thought_messages(question))
+    print(response)
+    return response
+
+
+@timed_stage("output_check")
+async def check_output(question, answer):
+    response = await get_completion_from_messages(output_check_prompt(question, answer),
+            max_tokens=1)
+    return output_check_result(answer, response)
+
+
+async def answer_question(question, language, update=None):
+    """
+    Same pipeline as support_pipeline.answer_question. With SPECULATIVE_ANSWER,
+    a failed guardrail really cancels the in-flight requests of the other stages.
+    """
+    run = QuestionRun(update)
+    try:
+        await run_question_stages(question, language, run)
+    except PromptTooLarge as error:
+        run.too_large(error)
+    return run.results
+
+
+async def run_question_stages(question, language, run):
+    guardrails = {
+        asyncio.ensure_future(check_moderation(question)): 'moderation_result',
+        asyncio.ensure_future(verify_prompt_injection(question, language)): 'prompt_injection_result',
+    }
+    classification_task = answer_task = None
+    if speculative_answer:
+        classification_task = asyncio.ensure_future(service_request_classification(question))
+        answer_task = asyncio.ensure_future(chain_of_thought_reasoning(question))
+
+    pending = set(guardrails)
+    blocked = False
+    while pending and not blocked:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            blocked = run.guardrail(guardrails[task], task.result()) or blocked
+
+    if blocked:
+        for task in [*pending, classification_task, answer_task]:
+            if task is not None:
+                task.cancel()
+        run.blocked([guardrails[task] for task in pending])
+        return
+
+    if answer_task is None:
+        classification_task = asyncio.ensure_future(service_request_classification(question))
+        answer_task = asyncio.ensure_future(chain_of_thought_reasoning(question))
+    run.report('question_answer', await answer_task)
+    run.report('output', await check_output(question, run.results['question_answer']))
+    run.report('classification', await classification_task)
+
+
+@app.errorhandler(PromptTooLarge)
+async def prompt_too_large(error):
+    print(f"\n{error}")
+    return too_large_answer, 413
+
+
+@app.route("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.render(metric_gauges()), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/", methods=("GET", "POST"))
+async def index():
+    comment = None
+    language = 'en'
+    selected_product = None
+    user_question = None
+    results = {}
+
+    if request.method == "POST":
+        form = await request.form
+        if 'generate-comment' in form:  # First form (Generate Comment)
+            selected_product = form.get("product")
+            language = form.get("language")
+            translate_comment = form.get("translate-comment")
+            comment = comment_pool.sample(selected_product, language if translate_comment else "en")
+            if comment is None:
+                comment = await generate_customer_comment(selected_product)
+                if translate_comment:
+                    comment = await get_translation(comment, language)
+
+        elif 'submit-question' in form:  # Second form (Ask Question)
+            user_question = form.get("user-question")
+            language = form.get("language", "en")
+            comment = form.get("generated-comment")
+            results = await answer_question(user_question, language)
+
+    return await render_template('index.html', comment=comment, language=language, products=catalog.get_products(),
+                                 selected_product=selected_product, user_question=user_question,
+                                 question_answer=results.get('question_answer'),
+                                 moderation_result=results.get('moderation_result'),
+                                 prompt_injection_result=results.get('prompt_injection_result'),
+                                 classification=results.get('classification'),
+                                 output=results.get('output'))
+
+
+@app.route("/stream-answer")
+async def stream_answer():
+    """Async version of app.stream_answer."""
+    question = request.args.get("question", "")
+    language = request.args.get("language", "en")
+    return Response(answer_events(question, language), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def answer_events(question, language):
+    """Async version of support_pipeline.answer_events."""
+    try:
+        async for event in stream_answer_events(question, language):
+            yield event
+    except PromptTooLarge as error:
+        print(f"\n{error}")
+        yield sse_event("blocked", too_large_answer)
+
+
+async def stream_answer_events(question, language):
+    guardrails = [
+        asyncio.ensure_future(check_moderation(question)),
+        asyncio.ensure_future(verify_prompt_injection(question, language)),
+    ]
+
+    async def guardrails_passed():
+        results = await asyncio.gather(*guardrails)
+        return not any(result in blocking_results for result in results)
+
+    stream = AnswerStream()
+    span, token = metrics.start("cot_answer_stream")
+    # A stream stopped by the guardrails is counted as blocked, not as an error
+    failed, blocked = True, False
+    try:
+        async for piece in stream_completion_from_messages(chain_of_thought_messages(question)):
+            events, text = stream.feed(piece)
+            for event in events:
+                yield event
+            if text:
+                if stream.check_guardrails() and not await guardrails_passed():
+                    failed, blocked = False, True
+                    yield sse_event("blocked", blocked_answer)
+                    return
+                yield sse_event("answer", text)
+        failed = False
+    finally:
+        metrics.finish(span, token, failed, blocked)
+
+    text = stream.finish()
+    if stream.check_guardrails() and not await guardrails_passed():
+        yield sse_event("blocked", blocked_answer)
+        return
+    if text:
+        yield sse_event("answer", text)
+    for event in stream.verdict(await check_output(question, stream.full_text)):
+        yield event
@@ -0,0 +1,220 @@
+# Batched LLM-as-judge grading of customer service answers
+import json, os
+from concurrent.futures import ThreadPoolExecutor
+from prompt_budget import prompt_budget, count_tokens, message_tokens, PromptTooLarge
+
+# Estimated prompt tokens of one request and items graded in it, larger answer sets are split.
+# Requests go through the prompt budget, so the limit is never above PROMPT_MAX_TOKENS.
+max_prompt_tokens = min(int(os.getenv("GRADER_MAX_PROMPT_TOKENS", str(prompt_budget.max_tokens))),
+                        prompt_budget.max_tokens)
+max_batch_items = int(os.getenv("GRADER_MAX_BATCH", "10"))
+
+# Grading requests in flight at the same time
+grader_workers = int(os.getenv("GRADER_WORKERS", "4"))
+
+choices = "ABCDE"
+
+rubric_instructions = """
+You are an assistant that evaluates how well the customer service agent \
+answers a user question by looking at the context that the agent is using \
+to generate its response.
+The input is a json object with the contexts and the items to evaluate. \
+Each item has an id, the question of the user, the id of its context \
+and the submitted answer. Compare the factual content of each submitted \
+answer with its context. Ignore any differences in style, grammar, or punctuation.
+Respond only with a json object mapping the id of each item to an object with:
+    "based_on_context": is the response based only on the context provided? ("Y" or "N")
+    "extra_information": does the answer include information that is not provided in the context? ("Y" or "N")
+    "disagreement": is there any disagreement between the response and the context? ("Y" or "N")
+    "questions_asked": how many questions the user asked (a number)
+    "questions_answered": for each question that the user asked, is there a corresponding answer to it? (a list of "Y" or "N")
+    "questions_addressed": of the questions asked, how many were addressed by the answer (a number)
+"""
+
+ideal_instructions = """
+You are an assistant that evaluates how well the customer service agent \
+answers a user question by comparing the response to the ideal (expert) response.
+The input is a json object with the expert answers and the items to evaluate. \
+Each item has an id, the question of the user, the id of its expert answer \
+and the submitted answer. Compare the factual content of each submitted \
+answer with its expert answer. Ignore any differences in style, grammar, or punctuation.
+The submitted answer may either be a subset or superset of the expert answer, \
+or it may conflict with it. Determine which case applies by selecting one of:
+    (A) The submitted answer is a subset of the expert answer and is fully consistent with it.
+    (B) The submitted answer is a superset of the expert answer and is fully consistent with it.
+    (C) The submitted answer contains all the same details as the expert answer.
+    (D) There is a disagreement between the submitted answer and the expert answer.
+    (E) The answers differ, but these differences don't matter from the perspective of factuality.
+Respond only with a json object mapping the id of each item to an object \
+with the single letter of the option, e.g. {"0": {"choice": "A"}}
+"""
+
+
+def as_text(value):
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def yes_no(value):
+    value = value.strip().upper()[:1] if isinstance(value, str) else ""
+    return value if value in ("Y", "N") else None
+
+
+def count(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    return int(value) if isinstance(value, str) and value.strip().isdigit() else None
+
+
+def validate_rubric(grade):
+    """The grade with normalized flags and counts, or None when it is incomplete."""
+    flags = {key: yes_no(grade.get(key)) for key in ("based_on_context", "extra_information", "disagreement")}
+    counts = {key: count(grade.get(key)) for key in ("questions_asked", "questions_addressed")}
+    answered = grade.get("questions_answered")
+    answered = [yes_no(value) for value in answered] if isinstance(answered, list) else [None]
+    if None in flags.values() or None in counts.values() or None in answered:
+        return None
+    return dict(flags, **counts, questions_answered=answered)
+
+
+def validate_ideal(grade):
+    choice = grade.get("choice")
+    choice = choice.strip().strip("()").upper()[:1] if isinstance(choice, str) else ""
+    return {'choice': choice} if choice and choice in choices else None
+
+
+# Per kind of grading: instructions, the field of an item compared against,
+# its name in the request, completion tokens per graded item and the validator
+kinds = {
+    'rubric': (rubric_instructions, 'context', 'contexts', 100, validate_rubric),
+    'ideal': (ideal_instructions, 'ideal_answer', 'experts', 15, validate_ideal),
+}
+
+
+def parse_grades(response):
+    try:
+        data = json.loads(response[response.index("{"):response.rindex("}") + 1])
+    except (ValueError, AttributeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class BatchGrader:
+    """
+    Grades many answers in a few requests. The instructions are sent once
+    per request and a context or expert answer shared by several items
+    only once, the batches are filled up to the prompt token budget. Items
+    whose grade is missing or malformed in the structured answer are graded
+    again one by one.
+    """
+
+    def __init__(self, complete, max_tokens=max_prompt_tokens, max_batch=max_batch_items,
+                 workers=grader_workers):
+        # complete(messages, max_tokens=..., response_format=...) returns the content of a chat completion
+        self.complete = complete
+        self.max_tokens = max_tokens
+        self.max_batch = max_batch
+        self.workers = workers
+        self.counts = {'items': 0, 'requests': 0, 'single_requests': 0, 'failed': 0}
+
+    def batches(self, items, kind):
+        """Indexes of the items per request, within the token budget and the batch size."""
+        instructions, reference, name, _, _ = kinds[kind]
+        # The instructions and the json skeleton, then the json of every item and reference
+        base = message_tokens(self.messages(items, [], kind))
+        batches = []
+        batch, references, tokens = [], set(), base
+        for index, item in enumerate(items):
+            text = as_text(item[reference])
+            cost = count_tokens(json.dumps({'id': str(index), 'question': item['customer_msg'], name[:-1]: "0",
+                                            'answer': item['answer']}, ensure_ascii=False))
+            shared = text in references
+            if batch and (tokens + cost + (0 if shared else count_tokens(json.dumps(text, ensure_ascii=False)))
+                          > self.max_tokens or len(batch) >= self.max_batch):
+                batches.append(batch)
+                batch, references, tokens = [], set(), base
+                shared = False
+            batch.append(index)
+            references.add(text)
+            tokens += cost + (0 if shared else count_tokens(json.dumps(text, ensure_ascii=False)))
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def messages(self, items, batch, kind):
+        instructions, reference, name, _, _ = kinds[kind]
+        reference_ids, payload = {}, {name: {}, 'items': []}
+        for index in batch:
+            text = as_text(items[index][reference])
+            if text not in reference_ids:
+                reference_ids[text] = str(len(reference_ids))
+                payload[name][reference_ids[text]] = text
+            payload['items'].append({'id': str(index), 'question': items[index]['customer_msg'],
+                                     name[:-1]: reference_ids[text], 'answer': items[index]['answer']})
+        return [
+            {'role': 'system', 'content': instructions},
+            {'role': 'user', 'content': json.dumps(payload, ensure_ascii=False)},
+        ]
+
+    def send(self, items, batch, kind):
+        """Valid grades of the answer by index, missing for the items that failed."""
+        _, _, _, item_tokens, validate = kinds[kind]
+        try:
+            # JSON mode makes the model return valid json, parse_grades still takes the json out of
+            # a response with text around it and validate() still drops malformed grades
+            response = self.complete(self.messages(items, batch, kind), max_tokens=item_tokens * len(batch) + 50,
+                                     response_format={"type": "json_object"})
+        except PromptTooLarge as exception:
+            if len(batch) == 1:
+                print(f"Grading request for item {batch[0]} is too large: {exception}")
+                return {}
+            # The estimate was too low for this batch, its halves are sent instead
+            print(f"Grading request for {len(batch)} items is too large, splitting it: {exception}")
+            middle = len(batch) // 2
+            return {**self.send(items, batch[:middle], kind), **self.send(items, batch[middle:], kind)}
+        except Exception as exception:
+            print(f"Grading request for {len(batch)} items failed: {type(exception).__name__}: {exception}")
+            return {}
+        grades = parse_grades(response)
+        valid = {}
+        for index in batch:
+            grade = grades.get(str(index))
+            grade = validate(grade) if isinstance(grade, dict) else None
+            if grade is not None:
+                valid[index] = grade
+        return valid
+
+    def grade(self, items, kind):
+        """
+        One grade dict per item in the order of the items. Every item has
+        'customer_msg', 'answer' and the 'context' (rubric) or 'ideal_answer' (ideal).
+        """
+        grades = [None] * len(items)
+        batches = self.batches(items, kind)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch, valid in zip(batches, executor.map(lambda batch: self.send(items, batch, kind), batches)):
+                for index, grade in valid.items():
+                    grades[index] = dict(grade, mode='batch')
+
+            missing = [index for index, grade in enumerate(grades) if grade is None]
+            if missing:
+                print(f"Grading {len(missing)} of {len(items)} items one by one")
+            for index, valid in zip(missing, executor.map(lambda index: self.send(items, [index], kind), missing)):
+                grades[index] = (dict(valid[index], mode='single') if index in valid
+                                 else {'error': "no valid grade in the response", 'mode': 'single'})
+
+        self.counts['items'] += len(items)
+        self.counts['requests'] += len(batches) + len(missing)
+        self.counts['single_requests'] += len(missing)
+        self.counts['failed'] += sum(1 for grade in grades if 'error' in grade)
+        return grades
+
+    def grade_rubric(self, items):
+        return self.grade(items, 'rubric')
+
+    def grade_ideal(self, items):
+        return self.grade(items, 'ideal')
+
+    def stats(self):
+        return dict(self.counts)
@@ -0,0 +1,158 @@
+# Record and replay of LLM calls, so evaluations can be rerun offline
+# LLM_CASSETTE_MODE=off     calls the API through the completion cache, measuring the live calls
+# LLM_CASSETTE_MODE=record  calls the API and appends new requests to the cassette
+# LLM_CASSETTE_MODE=replay  answers only from the cassette, requests must match exactly
+# LLM_CASSETTE_MODE=lenient answers from the cassette, ignoring model, token limit,
+#                           case and whitespace when there is no exact match
+import hashlib, json, os, re, threading, time
+import shared_modules
+from completion_cache import CompletionCache, cached_completion
+from local_models import append_jsonl, read_jsonl
+
+cassette_file = os.getenv("LLM_CASSETTE", "./data/cassettes/evaluation.jsonl")
+cassette_mode = os.getenv("LLM_CASSETTE_MODE", "off").lower()
+
+modes = ("off", "record", "replay", "lenient")
+
+
+class CassetteMiss(LookupError):
+    """A request that is not in the cassette while replaying."""
+
+
+def lenient_key(messages):
+    content = [[message['role'], re.sub(r"\s+", " ", message['content']).strip().lower()]
+               for message in messages]
+    return hashlib.sha256(json.dumps(content).encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    Records request and response pairs of get_completion_from_messages
+    to a JSONL file and plays them back. Latency and token usage are
+    kept per call and per evaluation case. Recording always calls the API,
+    a completion cache hit has no usage or latency to record.
+    """
+
+    def __init__(self, path=cassette_file, mode=cassette_mode, use_cache=True):
+        if mode not in modes:
+            raise ValueError(f"LLM_CASSETTE_MODE must be one of {', '.join(modes)}, not {mode}")
+        self.path = path
+        self.mode = mode
+        # Whether the off mode serves repeated requests from the completion cache
+        self.use_cache = use_cache
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.exact = {}
+        self.lenient = {}
+        self.counts = {'calls': 0, 'live': 0, 'cached': 0, 'replayed': 0, 'recorded': 0, 'prompt_tokens': 0,
+                       'completion_tokens': 0, 'seconds': 0.0}
+        if mode != "off":
+            for record in read_jsonl(path):
+                self.exact[record['key']] = record
+                self.lenient.setdefault(record['lenient_key'], record)
+            print(f"Cassette {path} ({mode}): {len(self.exact)} recorded requests")
+
+    def find(self, key, messages):
+        record = self.exact.get(key)
+        if record is None and self.mode == "lenient":
+            record = self.lenient.get(lenient_key(messages))
+        return record
+
+    def note_usage(self, usage):
+        """Called by the create function with response.usage of the live call."""
+        if usage is not None:
+            self.local.usage = {'prompt_tokens': usage.prompt_tokens or 0,
+                                'completion_tokens': usage.completion_tokens or 0}
+
+    def call(self, create):
+        """Content of a live API call with the usage noted by create() and its latency."""
+        self.local.usage = {'prompt_tokens': 0, 'completion_tokens': 0}
+        started = time.perf_counter()
+        content = create()
+        return content, {'usage': self.local.usage, 'seconds': round(time.perf_counter() - started, 3)}
+
+    def play(self, create, messages, model, temperature, max_tokens, response_format=None):
+        """
+        Content of the completion, from the cassette or from create(), the
+        function that calls the API and passes response.usage to note_usage.
+        """
+        if self.mode == "off":
+            # Live calls are measured for the per case token and latency counts,
+            # completion cache hits are counted apart since they cost nothing
+            def measured():
+                content, measurement = self.call(create)
+                self.count(measurement, 'live')
+                return content
+            if not self.use_cache:
+                return measured()
+            return cached_completion(measured, messages, model, temperature, max_tokens,
+                                     on_hit=lambda: self.count({}, 'cached'), response_format=response_format)
+
+        key = CompletionCache.make_key(model, messages, temperature, max_tokens, response_format)
+        record = self.find(key, messages)
+        if record is not None:
+            self.count(record, 'replayed')
+            return record['response']
+        if self.mode in ("replay", "lenient"):
+            raise CassetteMiss(f"No recorded response for request {key[:12]} in {self.path}")
+
+        content, measurement = self.call(create)
+        record = {
+            'key': key,
+            'lenient_key': lenient_key(messages),
+            'request': {'model': model, 'messages': messages, 'temperature': temperature,
+                        'max_tokens': max_tokens, 'response_format': response_format},
+            'response': content,
+            **measurement,
+        }
+        with self.lock:
+            if key not in self.exact:
+                append_jsonl(self.path, record)
+                self.exact[key] = record
+                self.lenient.setdefault(record['lenient_key'], record)
+        self.count(record, 'recorded')
+        return content
+
+    def count(self, record, source):
+        usage = record.get('usage') or {}
+        with self.lock:
+            self.counts['calls'] += 1
+            self.counts[source] += 1
+            self.counts['prompt_tokens'] += usage.get('prompt_tokens', 0)
+            self.counts['completion_tokens'] += usage.get('completion_tokens', 0)
+            # Replayed calls report the latency of the recorded call
+            self.counts['seconds'] += record.get('seconds', 0.0)
+        case = getattr(self.local, 'case', None)
+        if case is not None and source == 'cached':
+            case['cached_calls'] += 1
+        elif case is not None:
+            case['llm_calls'] += 1
+            case['prompt_tokens'] += usage.get('prompt_tokens', 0)
+            case['completion_tokens'] += usage.get('completion_tokens', 0)
+            case['llm_seconds'] += record.get('seconds', 0.0)
+
+    def measure(self, evaluate):
+        """
+        Wraps evaluate(case) -> score so that it returns the score together
+        with the LLM calls, tokens and recorded latency of the case.
+        """
+        def measured(case):
+            self.local.case = {'llm_calls': 0, 'cached_calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                               'llm_seconds': 0.0}
+            try:
+                score = evaluate(case)
+                return dict(self.local.case, score=score, llm_seconds=round(self.local.case['llm_seconds'], 3))
+            finally:
+                self.local.case = None
+        return measured
+
+    def report(self):
+        with self.lock:
+            counts = dict(self.counts)
+        return (f"Cassette {self.mode}: {counts['calls']} calls ({counts['live']} live, {counts['cached']} from the "
+                f"completion cache, {counts['replayed']} replayed, {counts['recorded']} recorded), "
+                f"{counts['prompt_tokens']} prompt and "
+                f"{counts['completion_tokens']} completion tokens, {counts['seconds']:.1f}s of LLM latency")
+
+
+cassette = Cassette()
@@ -0,0 +1,93 @@
+# Product catalog shared by the apps and the evaluation scripts
+import json, os, re, threading, time
+from collections import defaultdict
+
+products_file = "./data/products.json"
+
+# Seconds between checks of the file modification time
+check_interval = float(os.getenv("CATALOG_CHECK_SECONDS", "1"))
+
+
+def model_key(model_number):
+    """Model numbers are matched without case or separators, "tp-ub100" finds "TP-UB100"."""
+    return re.sub(r"[^a-z0-9]", "", model_number.lower())
+
+
+class Catalog:
+    """
+    products.json loaded once into hash indexes by name, case-folded name,
+    model number, brand and category. The file is only parsed again when
+    its modification time changes. The returned products are shared, so
+    callers must not modify them.
+    """
+
+    def __init__(self, path=products_file, check_interval=check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.checked_at = 0.0
+        # Changes on every reload, indexes built on top of the catalog compare it
+        self.version = 0
+        self.products = {}
+        self.by_folded_name = {}
+        self.by_model_number = {}
+        self.by_brand = {}
+        self.by_category = {}
+        self.products_and_category = {}
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.mtime is not None and now - self.checked_at < self.check_interval:
+            return
+        with self.lock:
+            self.checked_at = now
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self.mtime:
+                return
+            with open(self.path, 'r') as file:
+                self.load(json.load(file))
+            self.mtime = mtime
+            self.version += 1
+
+    def load(self, products):
+        by_brand, by_category = defaultdict(list), defaultdict(list)
+        for product in products.values():
+            by_brand[product['brand'].casefold()].append(product)
+            by_category[product['category']].append(product)
+
+        self.products = products
+        self.by_folded_name = {name.casefold(): product for name, product in products.items()}
+        self.by_model_number = {model_key(product['model_number']): product for product in products.values()}
+        self.by_brand = dict(by_brand)
+        self.by_category = dict(by_category)
+        self.products_and_category = {category: [product['name'] for product in category_products]
+                                      for category, category_products in by_category.items()}
+
+    def get_products(self):
+        self.refresh()
+        return self.products
+
+    def get_product_by_name(self, name):
+        self.refresh()
+        return self.products.get(name) or self.by_folded_name.get(name.casefold())
+
+    def get_product_by_model_number(self, model_number):
+        self.refresh()
+        return self.by_model_number.get(model_key(model_number))
+
+    def get_products_by_brand(self, brand):
+        self.refresh()
+        return self.by_brand.get(brand.casefold(), [])
+
+    def get_products_by_category(self, category):
+        self.refresh()
+        return self.by_category.get(category, [])
+
+    def get_products_and_category(self):
+        """Product names per category."""
+        self.refresh()
+        return self.products_and_category
+
+
+catalog = Catalog()
@@ -0,0 +1,231 @@
+# Precomputed customer comments for the generate-comment form
+# Build the pool offline with: python comment_pool.py build
+# Keep it fresh from one process with: python comment_pool.py refresh
+import json, mmap, os, random, struct, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+pool_file = os.getenv("COMMENT_POOL_FILE", "./data/comment_pool.bin")
+
+# Comments generated per product, their sampling temperature,
+# and the languages of the form they are translated into
+comments_per_product = int(os.getenv("COMMENT_POOL_SIZE", "5"))
+comment_temperature = float(os.getenv("COMMENT_POOL_TEMPERATURE", "0.9"))
+languages = ["en", "es", "fr", "de", "hi", "gu", "zh", "ja", "mr"]
+
+# Concurrent LLM requests of a build, and seconds between background refreshes (0 disables)
+build_workers = int(os.getenv("COMMENT_POOL_WORKERS", "8"))
+refresh_seconds = float(os.getenv("COMMENT_POOL_REFRESH_SECONDS", "86400"))
+
+# Seconds between checks for a pool file replaced by another process
+check_interval = float(os.getenv("COMMENT_POOL_CHECK_SECONDS", "5"))
+
+# File layout: magic, length of the json index, json index, utf-8 comments.
+# The index maps product -> language -> [[offset, length], ...] into the comment block.
+header = struct.Struct("<4sI")
+magic = b"CPL1"
+
+
+def build_pool(products, generate, translate, per_product=comments_per_product,
+               languages=languages, workers=build_workers):
+    """
+    Generate per_product comments for every product and translate each of
+    them into every language. translate(comment, languages) returns a
+    {language: translation} dict. At most `workers` LLM requests run at once.
+    Returns {product: {language: [comment, ...]}}.
+    """
+    pool = {product: {language: [] for language in languages} for product in products}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        comment_futures = [(product, executor.submit(generate, product))
+                           for product in products for _ in range(per_product)]
+
+        translation_futures = []
+        for product, future in comment_futures:
+            try:
+                comment = future.result()
+            except Exception as error:
+                print(f"Comment for {product} failed: {error}")
+                continue
+            if not comment:
+                continue
+            if "en" in pool[product]:
+                pool[product]["en"].append(comment)
+            targets = [language for language in languages if language != "en"]
+            if targets:
+                translation_futures.append((product, executor.submit(translate, comment, targets)))
+
+        for product, future in translation_futures:
+            try:
+                translations = future.result()
+            except Exception as error:
+                print(f"Translations of a {product} comment failed: {error}")
+                continue
+            for language, translation in translations.items():
+                if translation:
+                    pool[product][language].append(translation)
+    return pool
+
+
+def write_pool(pool, path=pool_file):
+    """
+    Write the pool to a new temporary file next to `path`, so readers never
+    see a partial file and concurrent builds never write the same file.
+    Returns the path of the temporary file, to be swapped in with replace().
+    """
+    index = {}
+    blob = bytearray()
+    for product, comments_by_language in pool.items():
+        index[product] = {}
+        for language, comments in comments_by_language.items():
+            entries = []
+            for comment in comments:
+                data = comment.encode('utf-8')
+                entries.append([len(blob), len(data)])
+                blob += data
+            index[product][language] = entries
+
+    index_data = json.dumps(index, separators=(",", ":")).encode('utf-8')
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory or ".", prefix=os.path.basename(path) + ".",
+                                     suffix=".tmp", delete=False) as file:
+        try:
+            file.write(header.pack(magic, len(index_data)))
+            file.write(index_data)
+            file.write(blob)
+        except BaseException:
+            file.close()
+            os.remove(file.name)
+            raise
+    return file.name
+
+
+class CommentPool:
+    """
+    Memory-mapped comment pool. Only the small index is parsed, the
+    comments are decoded from the mapping when they are served. A pool
+    file replaced by another process is mapped again on the next sample.
+    """
+
+    def __init__(self, path=pool_file, check_interval=check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.identity = None
+        self.checked_at = time.monotonic()
+        self.file = None
+        self.mapping = None
+        self.index = {}
+        self.start = 0
+        self.counts = {'served': 0, 'missed': 0}
+        self.open()
+
+    def file_identity(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def open(self):
+        self.identity = self.file_identity()
+        if self.identity is None or self.identity[2] < header.size:
+            return
+        self.file = open(self.path, 'rb')
+        self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, index_length = header.unpack_from(self.mapping, 0)
+        if file_magic != magic:
+            print(f"{self.path} is not a comment pool, ignoring it")
+            self.close()
+            return
+        self.index = json.loads(self.mapping[header.size:header.size + index_length].decode('utf-8'))
+        self.start = header.size + index_length
+        print(f"Loaded comment pool with {self.size()} comments from {self.path}")
+
+    def close(self):
+        if self.mapping is not None:
+            self.mapping.close()
+            self.file.close()
+        self.file = None
+        self.mapping = None
+        self.index = {}
+
+    def size(self):
+        return sum(len(entries) for languages in self.index.values() for entries in languages.values())
+
+    def sample(self, product, language="en"):
+        """A random precomputed comment, or None when the pool has none for this product and language."""
+        with self.lock:
+            self.check_file()
+            entries = self.index.get(product, {}).get(language)
+            if not entries:
+                self.counts['missed'] += 1
+                return None
+            offset, length = random.choice(entries)
+            self.counts['served'] += 1
+            return self.mapping[self.start + offset:self.start + offset + length].decode('utf-8')
+
+    def check_file(self):
+        """Map the pool file again when another process replaced it, called with the lock held."""
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        if self.file_identity() != self.identity:
+            self.close()
+            self.open()
+
+    def replace(self, temp_path):
+        """Swap in a newly written pool file."""
+        with self.lock:
+            # The old mapping has to be closed before the file can be replaced on Windows
+            self.close()
+            os.replace(temp_path, self.path)
+            self.open()
+
+    def refresh(self, products, generate, translate):
+        started = time.time()
+        pool = build_pool(products, generate, translate)
+        self.replace(write_pool(pool, self.path))
+        print(f"Comment pool refreshed in {time.time() - started:.0f}s")
+
+    def refresh_forever(self, products, generate, translate, interval=refresh_seconds):
+        """
+        Rebuild the pool every `interval` seconds (0 only builds a missing
+        pool), at once when there is no pool file yet. Only one process
+        should run this, the others map the new file on their own.
+        """
+        if self.size() > 0:
+            if interval <= 0:
+                return
+            time.sleep(interval)
+        else:
+            print(f"No comment pool in {self.path}, building it")
+        while True:
+            try:
+                self.refresh(products, generate, translate)
+            except Exception as error:
+                print(f"Comment pool refresh failed: {error}")
+            if interval <= 0:
+                return
+            time.sleep(interval)
+
+    def stats(self):
+        with self.lock:
+            return {'comments': self.size(), **self.counts}
+
+
+comment_pool = CommentPool()
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command in ('build', 'refresh'):
+        # support_pipeline loads its own instance of this module, the pool is rebuilt through that one
+        comment_pool.close()
+        from support_pipeline import products, pool_comment, pool_translations, comment_pool as app_pool
+        if command == 'build':
+            app_pool.refresh(list(products), pool_comment, pool_translations)
+        else:
+            app_pool.refresh_forever(list(products), pool_comment, pool_translations)
+    else:
+        print("Usage: python comment_pool.py build|refresh")
@@ -0,0 +1,60 @@
+# Incremental parser for streamed chain of thought answers
+import re
+
+response_marker = "Response to user:"
+
+
+class ChainOfThoughtStreamParser:
+    """
+    Consumes the completion as it is streamed and splits it into the hidden
+    reasoning steps and the visible "Response to user:" section.
+    feed() returns (steps, text) where steps are the newly started step
+    numbers and text is the visible response text that can be sent now.
+    """
+
+    def __init__(self, delimiter="#"):
+        self.delimiter = delimiter
+        self.step_pattern = re.compile(r"Step (\d+):\s*" + re.escape(delimiter))
+        self.buffer = ""
+        self.steps_seen = set()
+        self.responding = False
+        self.parts = []
+
+    def feed(self, text):
+        self.parts.append(text)
+        if self.responding:
+            return [], text
+
+        self.buffer += text
+        steps = []
+        for match in self.step_pattern.finditer(self.buffer):
+            step = int(match.group(1))
+            if step not in self.steps_seen:
+                self.steps_seen.add(step)
+                steps.append(step)
+
+        index = self.buffer.find(response_marker)
+        if index == -1:
+            # Keep only the tail that may hold the start of a split marker or step header
+            keep = max(len(response_marker), 16)
+            self.buffer = self.buffer[-keep:]
+            return steps, ""
+
+        self.responding = True
+        visible = self.buffer[index + len(response_marker):].lstrip()
+        self.buffer = ""
+        return steps, visible
+
+    def finish(self):
+        """
+        Text to show once the stream has ended. If the model never wrote the
+        marker, fall back to the text after the last delimiter.
+        """
+        if self.responding:
+            return ""
+        full = "".join(self.parts)
+        return full.split(self.delimiter)[-1].strip()
+
+    @property
+    def full_text(self):
+        return "".join(self.parts)
@@ -0,0 +1,104 @@
+# Evaluation over JSONL datasets, streamed and sharded across worker processes
+# Run with: python eval_dataset.py <dataset.jsonl> <results.jsonl> [module:function] [processes]
+# e.g.      python eval_dataset.py data/evaluation/product_extraction_dev.jsonl results/dev.jsonl evaluation_part_1:score_pair_v3 4
+import glob, importlib, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from eval_runner import EvalRunner, Tally, eval_workers, scored_ids
+from local_models import read_jsonl
+
+# Worker processes, each scores every n-th case with its own EVAL_WORKERS threads
+eval_processes = int(os.getenv("EVAL_PROCESSES", "1"))
+
+default_evaluate = "evaluation_part_1:score_pair"
+
+
+def stream_cases(path, shard=0, shards=1):
+    """Cases of the JSONL dataset that belong to the shard, read one line at a time."""
+    for number, case in enumerate(read_jsonl(path)):
+        if number % shards == shard:
+            yield case
+
+
+def shard_path(results, shard, shards):
+    """Every shard appends to its own results file, so processes never share one."""
+    if shards == 1:
+        return results
+    root, extension = os.path.splitext(results)
+    return f"{root}.shard-{shard}-of-{shards}{extension or '.jsonl'}"
+
+
+def results_files(results):
+    """
+    The results file and the shard files of every process count it was
+    run with, so a run resumed with a different count skips the same cases.
+    """
+    root, extension = os.path.splitext(results)
+    shards = sorted(glob.glob(f"{glob.escape(root)}.shard-*-of-*{extension or '.jsonl'}"))
+    return [path for path in [results] + shards if os.path.exists(path)]
+
+
+def load_function(name):
+    """The function named "module:function", importable in a worker process."""
+    module, function = name.split(":")
+    return getattr(importlib.import_module(module), function)
+
+
+def run_shard(dataset, results, evaluate, shard, shards, workers, scored=frozenset()):
+    runner = EvalRunner(load_function(evaluate), workers=workers, checkpoint=shard_path(results, shard, shards))
+    summary = runner.run_stream(stream_cases(dataset, shard, shards), scored=scored)
+    print(f"Shard {shard + 1} of {shards}: scored {summary['cases']} cases in {summary['seconds']}s")
+    return summary
+
+
+def summarize_results(paths):
+    """
+    Summary of the results files. A case that failed and was scored when
+    the run resumed counts once, with its score.
+    """
+    scored = set()
+    for path in paths:
+        scored |= scored_ids(path)
+    tally, seen = Tally(), set()
+    for path in paths:
+        for record in read_jsonl(path):
+            is_scored = record.get('score') is not None
+            if record['id'] in seen or (not is_scored and record['id'] in scored):
+                continue
+            seen.add(record['id'])
+            tally.add(record)
+    return tally
+
+
+def run_dataset(dataset, results, evaluate=default_evaluate, processes=eval_processes, workers=eval_workers):
+    """
+    Scores every case of the dataset with evaluate ("module:function"),
+    resuming from the results files of an interrupted run.
+    """
+    started = time.perf_counter()
+    # Cases scored by earlier runs, whatever number of processes they used
+    scored = set()
+    for path in results_files(results):
+        scored |= scored_ids(path)
+    if processes == 1:
+        run_shard(dataset, results, evaluate, 0, 1, workers, scored)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(run_shard, dataset, results, evaluate, shard, processes, workers, scored)
+                       for shard in range(processes)]
+            for future in futures:
+                future.result()
+
+    summary = summarize_results(results_files(results))
+    summary = summary.summary(time.perf_counter() - started)
+    print(f"Fraction correct out of {summary['cases']}: {summary['fraction_correct']} "
+          f"({summary['failed']} failed, {summary['retried']} retried, {summary['seconds']}s, "
+          f"{summary['prompt_tokens'] + summary['completion_tokens']} tokens)")
+    return summary
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit("usage: python eval_dataset.py <dataset.jsonl> <results.jsonl> [module:function] [processes]")
+    run_dataset(sys.argv[1], sys.argv[2],
+                sys.argv[3] if len(sys.argv) > 3 else default_evaluate,
+                int(sys.argv[4]) if len(sys.argv) > 4 else eval_processes)
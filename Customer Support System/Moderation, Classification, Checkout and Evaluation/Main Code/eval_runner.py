@@ -0,0 +1,227 @@
+# Concurrent evaluation runner with timeouts, retries and checkpointing
+# Run the dev set of evaluation_part_1 with: python eval_runner.py [checkpoint file]
+import hashlib, json, os, random, sys, threading, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, as_completed, wait
+from contextlib import contextmanager
+from local_models import append_jsonl, read_jsonl
+
+# Cases scored at once, seconds allowed per call, and attempts after the first one
+eval_workers = int(os.getenv("EVAL_WORKERS", "16"))
+call_timeout = float(os.getenv("EVAL_CALL_TIMEOUT", "60"))
+max_retries = int(os.getenv("EVAL_MAX_RETRIES", "3"))
+
+# Backoff before retry n is a random time up to backoff_base * 2 ** n, capped at backoff_max
+backoff_base = float(os.getenv("EVAL_BACKOFF_BASE", "1"))
+backoff_max = float(os.getenv("EVAL_BACKOFF_MAX", "30"))
+
+# Errors raised while parsing or scoring a response or by a cassette miss, retrying gives the same result
+non_retryable = (ValueError, TypeError, LookupError)
+
+
+def default_case_id(case):
+    if 'id' in case:
+        return str(case['id'])
+    return hashlib.sha256(json.dumps(case.get('customer_msg', case), sort_keys=True,
+                                     default=sorted).encode("utf-8")).hexdigest()[:16]
+
+
+def backoff_delay(attempt):
+    # Full jitter, so that retries of many workers do not hit the API together
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
+
+def load_checkpoint(path):
+    """Results of the cases that were already scored in an earlier run."""
+    return {record['id']: record for record in read_jsonl(path) if record.get('score') is not None}
+
+
+def scored_ids(path):
+    """Only the ids of the scored cases, so resuming a large run stays small in memory."""
+    return {record['id'] for record in read_jsonl(path) if record.get('score') is not None}
+
+
+class EvalRunner:
+    """
+    Scores cases concurrently with evaluate(case) -> score, or a dict with
+    the score and other fields to keep for the case. Every attempt
+    gets `timeout` seconds, transient errors are retried with jittered
+    exponential backoff, and each finished case is appended to the
+    checkpoint file so an interrupted run resumes where it stopped.
+    """
+
+    def __init__(self, evaluate, workers=eval_workers, timeout=call_timeout,
+                 retries=max_retries, checkpoint=None, case_id=default_case_id):
+        self.evaluate = evaluate
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.checkpoint = checkpoint
+        self.case_id = case_id
+        self.lock = threading.Lock()
+        self.attempts = None
+
+    @contextmanager
+    def attempt_pool(self):
+        """
+        Threads for the attempts of one run, shut down without waiting for
+        attempts that timed out. Each run gets its own, so a runner can run again.
+        """
+        # Attempts that timed out keep their thread until the client gives up,
+        # so there are enough threads for every attempt of every worker
+        self.attempts = ThreadPoolExecutor(max_workers=self.workers * (self.retries + 1))
+        try:
+            yield self.attempts
+        finally:
+            self.attempts.shutdown(wait=False)
+
+    def score_case(self, case):
+        started = time.perf_counter()
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(backoff_delay(attempt))
+            future = self.attempts.submit(self.evaluate, case)
+            try:
+                result = future.result(timeout=self.timeout)
+                result = result if isinstance(result, dict) else {'score': result}
+                return dict(result, attempts=attempt + 1, seconds=round(time.perf_counter() - started, 3))
+            except TimeoutError:
+                future.cancel()
+                error = f"timed out after {self.timeout}s"
+            except non_retryable as exception:
+                error = f"{type(exception).__name__}: {exception}"
+                break
+            except Exception as exception:
+                error = f"{type(exception).__name__}: {exception}"
+            print(f"Attempt {attempt + 1} failed: {error}")
+        return {'score': None, 'error': error, 'attempts': attempt + 1,
+                'seconds': round(time.perf_counter() - started, 3)}
+
+    def record(self, record):
+        if self.checkpoint:
+            with self.lock:
+                append_jsonl(self.checkpoint, record)
+
+    def run(self, cases):
+        """Returns the results in the order of the cases and a summary."""
+        ids = [self.case_id(case) for case in cases]
+        done = load_checkpoint(self.checkpoint) if self.checkpoint else {}
+        results = {case_id: done[case_id] for case_id in ids if case_id in done}
+        if results:
+            print(f"Resuming: {len(results)} of {len(cases)} cases already scored")
+
+        started = time.perf_counter()
+        todo = [(case_id, case) for case_id, case in zip(ids, cases) if case_id not in results]
+        with self.attempt_pool(), ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.score_case, case): case_id for case_id, case in todo}
+            for completed, future in enumerate(as_completed(futures), 1):
+                case_id = futures[future]
+                record = dict(future.result(), id=case_id)
+                results[case_id] = record
+                self.record(record)
+                if completed % 100 == 0 or completed == len(todo):
+                    print(f"Scored {completed} of {len(todo)} cases")
+
+        ordered = [results[case_id] for case_id in ids]
+        return ordered, summarize(ordered, time.perf_counter() - started)
+
+    def run_stream(self, cases, scored=()):
+        """
+        Scores an iterable of cases with at most 2 * workers of them in
+        memory, writing each result to the checkpoint file as it finishes.
+        Cases already scored in the checkpoint or listed in scored are
+        skipped. Returns the summary of the cases scored by this run.
+        """
+        done = scored_ids(self.checkpoint) if self.checkpoint else set()
+        done |= set(scored)
+        tally = Tally()
+        skipped = 0
+        started = time.perf_counter()
+
+        def finish(future, case_id):
+            record = dict(future.result(), id=case_id)
+            self.record(record)
+            tally.add(record)
+            if tally.cases % 100 == 0:
+                print(f"Scored {tally.cases} cases")
+
+        with self.attempt_pool(), ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {}
+            for case in cases:
+                case_id = self.case_id(case)
+                if case_id in done:
+                    skipped += 1
+                    continue
+                if len(pending) >= 2 * self.workers:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        finish(future, pending.pop(future))
+                pending[executor.submit(self.score_case, case)] = case_id
+            for future in as_completed(list(pending)):
+                finish(future, pending.pop(future))
+
+        if skipped:
+            print(f"Skipped {skipped} cases already scored")
+        return tally.summary(time.perf_counter() - started)
+
+
+class Tally:
+    """Running totals of the results, the summary without keeping the results."""
+
+    def __init__(self):
+        self.cases = 0
+        self.scored = 0
+        self.score_sum = 0.0
+        self.retried = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, result):
+        self.cases += 1
+        if result.get('score') is not None:
+            self.scored += 1
+            self.score_sum += result['score']
+        self.retried += result.get('attempts', 1) > 1
+        self.prompt_tokens += result.get('prompt_tokens', 0)
+        self.completion_tokens += result.get('completion_tokens', 0)
+
+    def summary(self, seconds):
+        return {
+            'cases': self.cases,
+            'scored': self.scored,
+            'failed': self.cases - self.scored,
+            'mean_score': self.score_sum / self.scored if self.scored else 0.0,
+            # Failed cases count as 0 in the fraction of correct cases
+            'fraction_correct': self.score_sum / self.cases if self.cases else 0.0,
+            'retried': self.retried,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'seconds': round(seconds, 1),
+        }
+
+
+def summarize(results, seconds):
+    tally = Tally()
+    for result in results:
+        tally.add(result)
+    return tally.summary(seconds)
+
+
+def run_evaluation(cases, evaluate, **options):
+    results, summary = EvalRunner(evaluate, **options).run(cases)
+    for index, result in enumerate(results):
+        line = f"{index}: {result['score'] if result.get('score') is not None else result.get('error')}"
+        if 'llm_calls' in result:
+            line += (f" ({result['seconds']}s, {result['llm_calls']} LLM calls with {result['llm_seconds']}s "
+                     f"of LLM latency, {result['prompt_tokens']} + {result['completion_tokens']} tokens)")
+        print(line)
+    print(f"Fraction correct out of {summary['cases']}: {summary['fraction_correct']} "
+          f"({summary['failed']} failed, {summary['seconds']}s, "
+          f"{summary['prompt_tokens'] + summary['completion_tokens']} tokens)")
+    return results, summary
+
+
+if __name__ == '__main__':
+    from evaluation_part_1 import msg_ideal_pairs_set, score_pair
+    checkpoint = sys.argv[1] if len(sys.argv) > 1 else None
+    run_evaluation(msg_ideal_pairs_set, score_pair, checkpoint=checkpoint)
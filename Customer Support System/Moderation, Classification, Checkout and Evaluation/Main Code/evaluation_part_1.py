@@ -1,7 +1,13 @@
 import json, openai, os
 from dotenv import load_dotenv
+from cassette import cassette
+from catalog import catalog
+from eval_runner import run_evaluation
+import shared_modules
+from llm_client import create_chat_completion
+from product_extractor import find_category_and_product_local
+from prompt_budget import prompt_budget, encode_products_and_category
 from products import products  
-from collections import defaultdict
 
 delimiter = "####"
 
@@ -15,33 +21,32 @@ def get_completion_from_messages(messages,
                                  model="gpt-3.5-turbo", 
                                  temperature=0, 
                                  max_tokens=500):
-    response = openai.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature, 
-        max_tokens=max_tokens, 
-    )
-    return response.choices[0].message.content
-
-products_file = "./data/products.json"
-
+    # Prompts above PROMPT_MAX_TOKENS raise PromptTooLarge before reaching the API
+    prompt_budget.check(messages)
+
+    def create():
+        response = create_chat_completion(
+            model=model,
+            messages=messages,
+            temperature=temperature, 
+            max_tokens=max_tokens, 
+        )
+        cassette.note_usage(response.usage)
+        return response.choices[0].message.content
+
+    # Repeated deterministic requests are served from the completion cache,
+    # with LLM_CASSETTE_MODE set they are recorded to or replayed from the cassette
+    return cassette.play(create, messages, model, temperature, max_tokens)
+
+# The catalog is parsed once and shared by every lookup
 def get_products():
-    with open(products_file, 'r') as file:
-        products = json.load(file)
-    return products
+    return catalog.get_products()
 
 def get_products_and_category():
     """
     Used in L5
     """
-    products = get_products()
-    products_by_category = defaultdict(list)
-    for product_name, product_info in products.items():
-        category = product_info.get('category')
-        if category:
-            products_by_category[category].append(product_info.get('name'))
-    
-    return dict(products_by_category)
+    return catalog.get_products_and_category()
 
 # Step 5: Evaluation Part I - Evaluate test cases by comparing customer messages ideal answers
 # Get the relevant products and categories
@@ -81,11 +86,10 @@ def find_category_and_product_v1(user_input,products_and_category):
     Do not assume, from the name of the product, any features 
            or attributes such as relative quality or price.
 
-    The allowed products are provided in JSON format.
-    The keys of each item represent the category.
-    The values of each item is a list of products that are 
-           within that category.
-    Allowed products: {products_and_category}
+    The allowed products are listed one category per line, \
+    the category name followed by the products within that category.
+    Allowed products:
+    {encode_products_and_category(products_and_category)}
     
 
     """
@@ -112,43 +116,6 @@ def find_category_and_product_v1(user_input,products_and_category):
 
     return get_completion_from_messages(messages)
 
-# Evaluate on some queries
-# Query 1
-customer_msg_0 = f"""Which TV can I buy if I'm on a budget?"""
-
-products_by_category_0 = find_category_and_product_v1(customer_msg_0, products_and_category)
-print("TV on budget: ", products_by_category_0)
-
-# Query 2
-customer_msg_1 = f"""I need a charger for my smartphone"""
-
-products_by_category_1 = find_category_and_product_v1(customer_msg_1, products_and_category)
-print("Charger for smart phome: ", products_by_category_1)
-
-# Query 3
-customer_msg_2 = f"""What computers do you have?"""
-
-products_by_category_2 = find_category_and_product_v1(customer_msg_2, products_and_category)
-print("List of computers: ", products_by_category_2)
-
-# Query 4
-customer_msg_3 = f"""tell me about the smartx pro phone and the fotosnap camera, the dslr one. Also, what TVs do you have?"""
-
-products_by_category_3 = find_category_and_product_v1(customer_msg_3, products_and_category)
-print("SmartX Pro Phone, FotoSnap DSLR Camera, TVs: ", products_by_category_3)
-
-# Harder test cases (version 2)
-# Harder query
-customer_msg_4 = f"""
-tell me about the CineView TV, the 8K one, 
-    Gamesphere console, the X one.
-I'm on a budget, what computers do you have?"""
-
-# Use the old solution (find_category_and_product_v1)
-# to handle the harder query
-products_by_category_4 = find_category_and_product_v1(customer_msg_4, products_and_category)
-print("Products by category: ", products_by_category_4)
-
 # Create a new solution (find_category_and_product_v2)
 # to handle the harder query
 def find_category_and_product_v2(user_input,products_and_category):
@@ -194,11 +161,10 @@ def find_category_and_product_v2(user_input,products_and_category):
     Do not assume, from the name of the product, any features or 
            attributes such as relative quality or price.
 
-    The allowed products  are provided in JSON format.
-    The keys of each item represent the category.
-    The values of each item is a list of products that are within 
-           that category.
-    Allowed products: {products_and_category}
+    The allowed products are listed one category per line, \
+    the category name followed by the products within that category.
+    Allowed products:
+    {encode_products_and_category(products_and_category)}
     
 
     """
@@ -241,28 +207,16 @@ def find_category_and_product_v2(user_input,products_and_category):
     return get_completion_from_messages(messages)
 
 
+# Find relevant product and category names locally (version 3)
+# The catalog is matched without an LLM call, find_category_and_product_v2
+# is only used when no product or category is recognized
+def find_category_and_product_v3(user_input,products_and_category):
+    response = find_category_and_product_local(user_input)
+    if response is None:
+        return find_category_and_product_v2(user_input, products_and_category)
+    return response
 
-# Check that modifying the model to fix the hard queries does not negatively affect its performance on previous simpler test cases
-customer_msg = f"""
-tell me about the smartx pro phone and the fotosnap camera,
-the dslr one. Also, what TVs do you have?"""
-
-products_by_category_3 = find_category_and_product_v2(
-     customer_msg_3,
-     products_and_category)
-print(products_by_category_3)
-
-
-# Use the modified model to test hard queries 
-
-# The following harder query is the same as Previous Query 1
-# which should have been fixed by the newly added 
-# few-shot learning case implemented in find_category_and_product_v2 
-customer_msg_0 = f"""Which TV can I buy if I'm on a budget?"""
 
-products_by_category_0 = find_category_and_product_v2(
-   customer_msg_0, products_and_category)
-print(products_by_category_0)
 
 ############################################################
 # Evaluate test cases by comparing customer messages ideal answers
@@ -460,39 +414,104 @@ def eval_response_with_ideal(response, ideal, debug=False):
         
     return pc_correct
 
-print(f'Customer message: {msg_ideal_pairs_set[7]["customer_msg"]}')
-print(f'Ideal answer: {msg_ideal_pairs_set[7]["ideal_answer"]}')
-
-response = find_category_and_product_v2(msg_ideal_pairs_set[7]
-       ["customer_msg"], products_and_category)
-print(f'Resonse: {response}')
-
-eval_response_with_ideal(response,
-       msg_ideal_pairs_set[7]["ideal_answer"])
-
 ############################################################
 # Run evaluation on all test cases and calculate the fraction of cases that are correct
 ############################################################
-# Note, this will not work if any of the api calls time out
-score_accum = 0
-for i, pair in enumerate(msg_ideal_pairs_set):
-    print(f"example {i}")
-    
-    customer_msg = pair['customer_msg']
-    ideal = pair['ideal_answer']
-    
-    # print("Customer message",customer_msg)
-    # print("ideal:",ideal)
-    response = find_category_and_product_v2(customer_msg, 
-               products_and_category)
+# Score one pair of the development set
+def score_pair(pair):
+    response = find_category_and_product_v2(pair['customer_msg'], products_and_category)
+    return eval_response_with_ideal(response, pair['ideal_answer'], debug=False)
 
-    
-    # print("products_by_category",products_by_category)
-    score = eval_response_with_ideal(response,ideal,debug=False)
-    print(f"{i}: {score}")
-    score_accum += score
-    
+def score_pair_v3(pair):
+    response = find_category_and_product_v3(pair['customer_msg'], products_and_category)
+    return eval_response_with_ideal(response, pair['ideal_answer'], debug=False)
+
+# Prompt variants compared side by side by prompt_sweep.py
+extractor_variants = {
+    'v1': find_category_and_product_v1,
+    'v2': find_category_and_product_v2,
+    'v3': find_category_and_product_v3,
+}
+
+def score_variant(variant, pair):
+    response = variant(pair['customer_msg'], products_and_category)
+    return eval_response_with_ideal(response, pair['ideal_answer'], debug=False)
+
+
+if __name__ == "__main__":
+    # Evaluate on some queries
+    # Query 1
+    customer_msg_0 = f"""Which TV can I buy if I'm on a budget?"""
+
+    products_by_category_0 = find_category_and_product_v1(customer_msg_0, products_and_category)
+    print("TV on budget: ", products_by_category_0)
+
+    # Query 2
+    customer_msg_1 = f"""I need a charger for my smartphone"""
+
+    products_by_category_1 = find_category_and_product_v1(customer_msg_1, products_and_category)
+    print("Charger for smart phome: ", products_by_category_1)
+
+    # Query 3
+    customer_msg_2 = f"""What computers do you have?"""
+
+    products_by_category_2 = find_category_and_product_v1(customer_msg_2, products_and_category)
+    print("List of computers: ", products_by_category_2)
+
+    # Query 4
+    customer_msg_3 = f"""tell me about the smartx pro phone and the fotosnap camera, the dslr one. Also, what TVs do you have?"""
+
+    products_by_category_3 = find_category_and_product_v1(customer_msg_3, products_and_category)
+    print("SmartX Pro Phone, FotoSnap DSLR Camera, TVs: ", products_by_category_3)
+
+    # Harder test cases (version 2)
+    # Harder query
+    customer_msg_4 = f"""
+    tell me about the CineView TV, the 8K one, 
+        Gamesphere console, the X one.
+    I'm on a budget, what computers do you have?"""
+
+    # Use the old solution (find_category_and_product_v1)
+    # to handle the harder query
+    products_by_category_4 = find_category_and_product_v1(customer_msg_4, products_and_category)
+    print("Products by category: ", products_by_category_4)
+
+    # Check that modifying the model to fix the hard queries does not negatively affect its performance on previous simpler test cases
+    customer_msg = f"""
+    tell me about the smartx pro phone and the fotosnap camera,
+    the dslr one. Also, what TVs do you have?"""
+
+    products_by_category_3 = find_category_and_product_v2(
+         customer_msg_3,
+         products_and_category)
+    print(products_by_category_3)
+
+
+    # Use the modified model to test hard queries 
+
+    # The following harder query is the same as Previous Query 1
+    # which should have been fixed by the newly added 
+    # few-shot learning case implemented in find_category_and_product_v2 
+    customer_msg_0 = f"""Which TV can I buy if I'm on a budget?"""
+
+    products_by_category_0 = find_category_and_product_v2(
+       customer_msg_0, products_and_category)
+    print(products_by_category_0)
+
+    print(f'Customer message: {msg_ideal_pairs_set[7]["customer_msg"]}')
+    print(f'Ideal answer: {msg_ideal_pairs_set[7]["ideal_answer"]}')
+
+    response = find_category_and_product_v2(msg_ideal_pairs_set[7]
+           ["customer_msg"], products_and_category)
+    print(f'Resonse: {response}')
+
+    eval_response_with_ideal(response,
+           msg_ideal_pairs_set[7]["ideal_answer"])
+
+    # Cases are scored concurrently, a call that times out or fails is retried
+    # and does not abort the run (see eval_runner.py)
+    run_evaluation(msg_ideal_pairs_set, cassette.measure(score_pair))
 
-n_examples = len(msg_ideal_pairs_set)
-fraction_correct = score_accum / n_examples
-print(f"Fraction correct out of {n_examples}: {fraction_correct}")
\ No newline at end of file
+    # Same test cases with the local extractor
+    run_evaluation(msg_ideal_pairs_set, cassette.measure(score_pair_v3))
+    print(cassette.report())
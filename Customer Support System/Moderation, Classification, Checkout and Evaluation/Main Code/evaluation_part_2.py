@@ -1,7 +1,13 @@
 import json, openai, os
 from dotenv import load_dotenv
+from batch_grader import BatchGrader
+from cassette import cassette
+from catalog import catalog
+import shared_modules
+from llm_client import create_chat_completion
+from product_extractor import find_category_and_product_local
+from prompt_budget import prompt_budget, encode_products_and_category
 from products import products  
-from collections import defaultdict
 # Run through the end-to-end system to answer the user query
 
 # Load environment variables for OpenAI API key
@@ -17,49 +23,55 @@ do you have?"""
 def get_completion_from_messages(messages, 
                                  model="gpt-3.5-turbo", 
                                  temperature=0, 
-                                 max_tokens=500):
-    response = openai.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature, 
-        max_tokens=max_tokens, 
-    )
-    return response.choices[0].message.content
-
-products_file = "./data/products.json"
-
+                                 max_tokens=500,
+                                 response_format=None):
+    # Prompts above PROMPT_MAX_TOKENS raise PromptTooLarge before reaching the API
+    prompt_budget.check(messages)
+    # e.g. {"type": "json_object"}, so that the model answers with valid json
+    options = {'response_format': response_format} if response_format else {}
+
+    def create():
+        response = create_chat_completion(
+            model=model,
+            messages=messages,
+            temperature=temperature, 
+            max_tokens=max_tokens, 
+            **options
+        )
+        cassette.note_usage(response.usage)
+        return response.choices[0].message.content
+
+    # Repeated deterministic requests are served from the completion cache,
+    # with LLM_CASSETTE_MODE set they are recorded to or replayed from the cassette
+    return cassette.play(create, messages, model, temperature, max_tokens, response_format)
+
+# The catalog is parsed once and shared by every lookup
 def get_products():
-    with open(products_file, 'r') as file:
-        products = json.load(file)
-    return products
+    return catalog.get_products()
 
 def get_products_and_category():
     """
     Used in L5
     """
-    products = get_products()
-    products_by_category = defaultdict(list)
-    for product_name, product_info in products.items():
-        category = product_info.get('category')
-        if category:
-            products_by_category[category].append(product_info.get('name'))
-    
-    return dict(products_by_category)
+    return catalog.get_products_and_category()
 
 # product look up (either by category or by product within category)
 def get_product_by_name(name):
-    products = get_products()
-    return products.get(name, None)
+    return catalog.get_product_by_name(name)
 
 def get_products_by_category(category):
-    products = get_products()
-    return [product for product in products.values() if product["category"] == category]
+    return catalog.get_products_by_category(category)
 
 
 def get_products_from_query(user_msg):
     """
     Code from L5, used in L8
     """
+    # Products and categories named literally are found without the LLM
+    local_response = find_category_and_product_local(user_msg)
+    if local_response is not None:
+        return local_response
+
     products_and_category = get_products_and_category()
     delimiter = "####"
     system_message = f"""
@@ -75,10 +87,10 @@ def get_products_from_query(user_msg):
     If a product is mentioned, it must be associated with the correct category in the allowed products list below.
     If no products or categories are found, output an empty list.
 
-    The allowed products are provided in JSON format.
-    The keys of each item represent the category.
-    The values of each item is a list of products that are within that category.
-    Allowed products: {products_and_category}
+    The allowed products are listed one category per line, \
+    the category name followed by the products within that category.
+    Allowed products:
+    {encode_products_and_category(products_and_category)}
 
     """
     
@@ -382,4 +394,28 @@ eval_vs_ideal(test_set_ideal, assistant_answer)
 # Abnormal assistant answer
 assistant_answer_2 = "life is like a box of chocolates"
 
-eval_vs_ideal(test_set_ideal, assistant_answer_2)
\ No newline at end of file
+eval_vs_ideal(test_set_ideal, assistant_answer_2)
+
+
+############################################################
+# Grade many answers at once: the rubric and the options are sent once per request
+# and each answer gets a structured grade (Y/N flags and counts, or the option A-E)
+############################################################
+
+batch_grader = BatchGrader(get_completion_from_messages)
+
+def eval_with_rubric_batch(test_sets, assistant_answers):
+    items = [dict(test_set, answer=answer) for test_set, answer in zip(test_sets, assistant_answers)]
+    return batch_grader.grade_rubric(items)
+
+def eval_vs_ideal_batch(test_sets, assistant_answers):
+    items = [dict(test_set, answer=answer) for test_set, answer in zip(test_sets, assistant_answers)]
+    return batch_grader.grade_ideal(items)
+
+
+answers = [assistant_answer, assistant_answer_2]
+print(eval_with_rubric_batch([cust_prod_info] * len(answers), answers))
+print(eval_vs_ideal_batch([test_set_ideal] * len(answers), answers))
+print(batch_grader.stats())
+
+print(cassette.report())
\ No newline at end of file
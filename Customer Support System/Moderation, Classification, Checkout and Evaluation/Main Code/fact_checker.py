@@ -0,0 +1,108 @@
+# Deterministic check of the catalog facts cited in an answer
+import re
+from catalog import model_key
+from product_retrieval import get_product_index
+from cot_stream import response_marker
+
+price_pattern = re.compile(r"\$\s?(\d[\d,]*(?:\.\d{1,2})?)")
+warranty_pattern = re.compile(r"\b(\d+|one|two|three)[- ]years?\b(?=[^.\n]{0,20}warranty)|warranty[^.\n]{0,20}?\b(\d+|one|two|three)[- ]years?\b", re.IGNORECASE)
+rating_pattern = re.compile(r"\b(\d\.\d)\s*(?:/\s*5|out of 5|stars?)|\brat(?:ed|ing)(?: of)?\s*(\d\.\d)\b", re.IGNORECASE)
+model_number_pattern = re.compile(r"\b[A-Z]{2}-[A-Z0-9]{1,8}\b")
+
+number_words = {'one': 1, 'two': 2, 'three': 3}
+
+
+def warranty_years(text):
+    value = text.lower()
+    return number_words.get(value) or int(value)
+
+
+def find_mentions(answer):
+    """(position, product) for every catalog product named in the answer."""
+    product_index = get_product_index()
+    mentions = []
+    lowered = answer.lower()
+    for name, product in product_index.products.items():
+        for match in re.finditer(re.escape(name.lower()), lowered):
+            mentions.append((match.start(), product))
+    for match in model_number_pattern.finditer(answer):
+        key = model_key(match.group(0))
+        if key in product_index.by_model_number:
+            mentions.append((match.start(), product_index.by_model_number[key]))
+    return sorted(mentions, key=lambda mention: mention[0])
+
+
+def closest_product(mentions, position):
+    """The product named most recently before the given position."""
+    product = None
+    for mention_position, mentioned in mentions:
+        if mention_position > position:
+            break
+        product = mentioned
+    return product
+
+
+def extract_facts(answer):
+    """(position, field, value) for every price, warranty, rating and model number."""
+    facts = []
+    for match in price_pattern.finditer(answer):
+        facts.append((match.start(), 'price', float(match.group(1).replace(",", ""))))
+    for match in warranty_pattern.finditer(answer):
+        facts.append((match.start(), 'warranty', warranty_years(match.group(1) or match.group(2))))
+    for match in rating_pattern.finditer(answer):
+        facts.append((match.start(), 'rating', float(match.group(1) or match.group(2))))
+    for match in model_number_pattern.finditer(answer):
+        facts.append((match.start(), 'model_number', match.group(0)))
+    return facts
+
+
+def fact_matches(product, field, value):
+    if field == 'price':
+        return abs(product['price'] - value) < 0.01
+    if field == 'warranty':
+        return warranty_years(product['warranty'].split()[0]) == value
+    if field == 'rating':
+        return abs(product['rating'] - value) < 0.01
+    return product['model_number'].upper() == value.upper()
+
+
+def verify_answer_facts(answer):
+    """
+    Returns a dict with a verdict of 'pass' or 'ambiguous', the products
+    the answer refers to and the issues found.
+    Facts are attributed to the product named most recently before them.
+    A mismatch is not a failure: answers correct the customer's wrong
+    assumptions ("not $500, it costs $599.99") and compare products. Only
+    prices, warranties, ratings and model numbers are checked, so the LLM
+    judge still decides every answer, given the products found here.
+    """
+    # The reasoning steps quote the customer's assumptions, only the response is checked
+    if response_marker in answer:
+        answer = answer.split(response_marker, 1)[1]
+
+    mentions = find_mentions(answer)
+    products = []
+    for _, product in mentions:
+        if product not in products:
+            products.append(product)
+
+    by_model_number = get_product_index().by_model_number
+    issues = []
+    verified = 0
+    for position, field, value in extract_facts(answer):
+        if field == 'model_number' and model_key(value) not in by_model_number:
+            issues.append(f"Unknown model number {value}")
+            continue
+        product = closest_product(mentions, position)
+        if product is not None and fact_matches(product, field, value):
+            verified += 1
+        elif any(fact_matches(other, field, value) for other in products):
+            issues.append(f"{field} {value} matches another mentioned product")
+        elif product is None:
+            issues.append(f"{field} {value} is not attributed to a product")
+        else:
+            issues.append(f"{product['name']} has {field} {product[field]}, not {value}")
+
+    verdict = 'pass' if products and verified and not issues else 'ambiguous'
+    print(f"\nLocal fact check: {verdict} ({verified} facts verified) {issues}")
+    return {'verdict': verdict, 'products': products, 'issues': issues}
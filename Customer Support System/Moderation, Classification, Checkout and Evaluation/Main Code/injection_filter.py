@@ -0,0 +1,123 @@
+# Local prompt injection pre-filter that runs before the LLM check
+import os, random, re, sys, threading
+from local_models import LogisticRegression, extract_features, append_jsonl, read_jsonl
+
+verdicts_file = "./data/injection_verdicts.jsonl"
+model_file = "./data/injection_model.json"
+
+# Phrases that are almost always an attempt to override the system instructions
+injection_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in [
+    r"\b(ignore|disregard|forget|override|bypass)\b.{0,20}\b(previous|prior|above|earlier|system|your)\s+"
+    r"(instructions?|rules|prompts?|directions|guidelines)\b",
+    r"\b(reveal|show|print|repeat)\b.{0,30}\b(your\s+)?(system\s+prompt|your\s+instructions)\b",
+]]
+
+# Phrases that also occur in ordinary support questions ("act as a media player",
+# "developer mode on my phone"), a match is escalated to the LLM instead of blocked
+suspicious_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in [
+    r"\b(previous|prior|above|earlier)\s+(instructions?|prompts?)\b",
+    r"\byou\s+are\s+(now|no\s+longer)\b",
+    r"\bpretend\s+(to\s+be|you)\b",
+    r"\b(act|behave)\s+(as\s+if|like)\s+you\b",
+    r"\b(jailbreak|developer\s+mode|dan\s+mode)\b",
+    r"\b(follow|obey|here\s+are)\b.{0,20}\bnew\s+(instructions?|rules)\b",
+]]
+
+# Scores below allow_below are accepted, above block_above are rejected,
+# anything in between is escalated to the LLM check
+allow_below = float(os.getenv("INJECTION_ALLOW_BELOW", "0.2"))
+block_above = float(os.getenv("INJECTION_BLOCK_ABOVE", "0.9"))
+
+# Fraction of the locally decided questions that still get an LLM verdict, so the
+# model is trained on clear cases too and not only on the escalated borderline ones
+audit_rate = float(os.getenv("INJECTION_AUDIT_RATE", "0.05"))
+
+
+class InjectionPrefilter:
+    """
+    Scores a question with patterns and, once trained, a logistic regression
+    model over logged LLM verdicts. Only ambiguous scores are escalated,
+    until a model is trained only the clear injections are decided locally.
+    """
+
+    def __init__(self, allow_below=allow_below, block_above=block_above, model=None, audit_rate=audit_rate):
+        self.allow_below = allow_below
+        self.block_above = block_above
+        self.audit_rate = audit_rate
+        self.model = model
+        self.lock = threading.Lock()
+        self.counts = {'allowed': 0, 'blocked': 0, 'escalated': 0}
+
+    def score(self, question):
+        """Probability that the question is a prompt injection."""
+        if any(pattern.search(question) for pattern in injection_patterns):
+            return 0.99
+
+        if self.model is None:
+            # Without a model trained on LLM verdicts a plain looking question ("from now on
+            # answer only in French") is not known to be safe, every question is escalated
+            return 0.5
+        score = self.model.predict_proba(extract_features(question))
+
+        if any(pattern.search(question) for pattern in suspicious_patterns):
+            # Kept inside the escalation band, the LLM decides
+            return min(max(score, 0.5), self.block_above)
+        return score
+
+    def screen(self, question):
+        """Return 'Y' or 'N' when the score is clear, None to escalate to the LLM."""
+        score = self.score(question)
+        if score < self.allow_below:
+            verdict, outcome = 'N', 'allowed'
+        elif score > self.block_above:
+            verdict, outcome = 'Y', 'blocked'
+        else:
+            verdict, outcome = None, 'escalated'
+        with self.lock:
+            self.counts[outcome] += 1
+        print(f"\nInjection pre-filter score {score:.2f}: {outcome} "
+              f"(escalation rate {self.escalation_rate():.1%})")
+        return verdict
+
+    def audit(self):
+        """Whether a locally decided question should also get an LLM verdict."""
+        return random.random() < self.audit_rate
+
+    def escalation_rate(self):
+        total = sum(self.counts.values())
+        return self.counts['escalated'] / total if total else 0.0
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, escalation_rate=self.escalation_rate())
+
+
+def log_verdict(question, verdict, local=None):
+    """Keep the LLM verdict so that the local model can be retrained on it."""
+    append_jsonl(verdicts_file, {'question': question, 'verdict': verdict, 'local': local})
+
+
+def train(path=verdicts_file, output=model_file):
+    examples = [(extract_features(record['question']), 1 if record['verdict'] == 'Y' else 0)
+                for record in read_jsonl(path)]
+    if not examples:
+        print(f"No verdicts found in {path}")
+        return None
+    model = LogisticRegression().train(examples)
+    model.save(output)
+    print(f"Trained injection model on {len(examples)} verdicts, saved to {output}")
+    return model
+
+
+def load_prefilter():
+    model = LogisticRegression.load(model_file) if os.path.exists(model_file) else None
+    return InjectionPrefilter(model=model)
+
+
+injection_prefilter = load_prefilter()
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'train':
+        train()
+    else:
+        print("Usage: python injection_filter.py train")
@@ -0,0 +1,122 @@
+# Small text models that run locally in front of the LLM checks
+import json, math, os, random, re
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+def extract_features(text):
+    """Unigram and bigram counts of the text."""
+    tokens = tokenize(text)
+    features = {}
+    for feature in tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]:
+        features[feature] = features.get(feature, 0) + 1
+    return features
+
+
+def append_jsonl(path, record):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(record) + "\n")
+
+
+def read_jsonl(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class LogisticRegression:
+    """Binary logistic regression over sparse feature dicts, trained with SGD."""
+
+    def __init__(self, weights=None, bias=0.0):
+        self.weights = weights or {}
+        self.bias = bias
+
+    def predict_proba(self, features):
+        z = self.bias + sum(self.weights.get(f, 0.0) * v for f, v in features.items())
+        z = max(min(z, 30.0), -30.0)
+        return 1.0 / (1.0 + math.exp(-z))
+
+    def train(self, examples, epochs=20, learning_rate=0.1, l2=1e-4, seed=0):
+        """examples is a list of (features, label) pairs with label 0 or 1."""
+        examples = list(examples)
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(examples)
+            for features, label in examples:
+                error = self.predict_proba(features) - label
+                self.bias -= learning_rate * error
+                for f, v in features.items():
+                    w = self.weights.get(f, 0.0)
+                    self.weights[f] = w - learning_rate * (error * v + l2 * w)
+        return self
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'weights': self.weights, 'bias': self.bias}, file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        return cls(data['weights'], data['bias'])
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes over sparse feature dicts with Laplace smoothing."""
+
+    def __init__(self, class_counts=None, feature_counts=None, totals=None, vocabulary=None):
+        self.class_counts = class_counts or {}
+        self.feature_counts = feature_counts or {}
+        self.totals = totals or {}
+        self.vocabulary = set(vocabulary or [])
+
+    def train(self, examples):
+        """examples is a list of (features, label) pairs."""
+        for features, label in examples:
+            self.class_counts[label] = self.class_counts.get(label, 0) + 1
+            counts = self.feature_counts.setdefault(label, {})
+            for f, v in features.items():
+                counts[f] = counts.get(f, 0) + v
+                self.totals[label] = self.totals.get(label, 0) + v
+                self.vocabulary.add(f)
+        return self
+
+    def predict_proba(self, features):
+        """Probability of each label, normalized over the known labels."""
+        if not self.class_counts:
+            return {}
+        n_examples = sum(self.class_counts.values())
+        vocabulary_size = len(self.vocabulary) or 1
+        log_scores = {}
+        for label, count in self.class_counts.items():
+            counts = self.feature_counts.get(label, {})
+            denominator = self.totals.get(label, 0) + vocabulary_size
+            score = math.log(count / n_examples)
+            for f, v in features.items():
+                if f in self.vocabulary:
+                    score += v * math.log((counts.get(f, 0) + 1) / denominator)
+            log_scores[label] = score
+        top = max(log_scores.values())
+        exp_scores = {label: math.exp(score - top) for label, score in log_scores.items()}
+        total = sum(exp_scores.values())
+        return {label: score / total for label, score in exp_scores.items()}
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'class_counts': self.class_counts, 'feature_counts': self.feature_counts,
+                       'totals': self.totals, 'vocabulary': sorted(self.vocabulary)}, file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        return cls(data['class_counts'], data['feature_counts'], data['totals'], data['vocabulary'])
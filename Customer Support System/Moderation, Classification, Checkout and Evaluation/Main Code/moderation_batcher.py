@@ -0,0 +1,117 @@
+# Micro-batching client for the moderation endpoint
+import hashlib, os, queue, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import shared_modules
+from llm_client import create_moderation
+
+# Milliseconds to wait for more inputs after the first one, and the largest batch sent at once
+batch_window_ms = float(os.getenv("MODERATION_BATCH_WINDOW_MS", "5"))
+max_batch_size = int(os.getenv("MODERATION_MAX_BATCH", "32"))
+
+# Batches that may be in flight at the same time, and verdicts kept in memory
+batch_workers = int(os.getenv("MODERATION_BATCH_WORKERS", "4"))
+cache_entries = int(os.getenv("MODERATION_CACHE_ENTRIES", "10000"))
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ModerationBatcher:
+    """
+    Collects the inputs submitted by concurrent requests for batch_window_ms,
+    sends them as one list to the moderation endpoint and hands every
+    request its own result. Identical texts are sent once and their
+    verdicts are cached.
+    """
+
+    def __init__(self, create=create_moderation, window_ms=batch_window_ms,
+                 max_batch=max_batch_size, workers=batch_workers, max_cache_entries=cache_entries):
+        self.create = create
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.max_cache_entries = max_cache_entries
+        self.queue = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        # Futures waiting for the verdict of a text that is queued or in flight
+        self.waiting = {}
+        self.collector = None
+        self.counts = {'inputs': 0, 'cache_hits': 0, 'batches': 0, 'batched_inputs': 0}
+
+    def submit(self, text):
+        """Future of the moderation result of the text."""
+        key = text_key(text)
+        future = Future()
+        with self.lock:
+            self.counts['inputs'] += 1
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.counts['cache_hits'] += 1
+                future.set_result(self.cache[key])
+                return future
+            if key in self.waiting:
+                self.waiting[key].append(future)
+                return future
+            self.waiting[key] = [future]
+            if self.collector is None:
+                self.collector = threading.Thread(target=self.collect, name="moderation-batcher", daemon=True)
+                self.collector.start()
+        self.queue.put((key, text))
+        return future
+
+    def moderate(self, text):
+        return self.submit(text).result()
+
+    def collect(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.executor.submit(self.send, batch)
+
+    def send(self, batch):
+        results, error = None, None
+        try:
+            results = self.create(input=[text for _, text in batch]).results
+            if len(results) != len(batch):
+                raise ValueError(f"Moderation returned {len(results)} results for {len(batch)} inputs")
+        except Exception as exception:
+            error = exception
+
+        with self.lock:
+            self.counts['batches'] += 1
+            self.counts['batched_inputs'] += len(batch)
+            for i, (key, _) in enumerate(batch):
+                futures = self.waiting.pop(key, [])
+                if error is None:
+                    self.remember(key, results[i])
+                for future in futures:
+                    if error is None:
+                        future.set_result(results[i])
+                    else:
+                        future.set_exception(error)
+
+    def remember(self, key, result):
+        self.cache[key] = result
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_cache_entries:
+            self.cache.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            batches = self.counts['batches']
+            return dict(self.counts,
+                        average_batch_size=self.counts['batched_inputs'] / batches if batches else 0.0)
+
+
+moderation_batcher = ModerationBatcher()
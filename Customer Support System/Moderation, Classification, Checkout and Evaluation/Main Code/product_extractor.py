@@ -0,0 +1,253 @@
+# Local product and category extraction, an alternative to the LLM extraction prompts
+import json, re, threading
+from collections import deque
+from catalog import catalog
+from product_retrieval import category_synonyms, tokenize
+
+# Product words shorter than this only count right after their brand ("the X one")
+min_keyword_length = 5
+
+# Clauses end at these characters, a brand does not reach past them
+clause_pattern = re.compile(r"[.?!;]+")
+
+
+class TokenAutomaton:
+    """Aho-Corasick automaton over token sequences, finds all patterns in one pass."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+
+    def add(self, tokens, payload):
+        state = 0
+        for token in tokens:
+            if token not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.goto[state][token] = len(self.goto) - 1
+            state = self.goto[state][token]
+        self.outputs[state].append((len(tokens), payload))
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(token, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+        return self
+
+    def search(self, tokens):
+        """(start, end, payload) of every pattern occurrence."""
+        matches = []
+        state = 0
+        for position, token in enumerate(tokens):
+            while state and token not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(token, 0)
+            for length, payload in self.outputs[state]:
+                matches.append((position + 1 - length, position + 1, payload))
+        return matches
+
+
+def deletions(token):
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+class ProductExtractor:
+    """
+    Finds the products and categories named in a customer message and
+    returns them in the format of find_category_and_product_v2:
+    [{'category': <category>, 'products': [<product name>, ...]}].
+
+    A brand opens a window up to the next brand or the end of the clause,
+    the words in it narrow the brand down to a product, so "the fotosnap
+    camera, the dslr one" resolves to the FotoSnap DSLR Camera. Words of
+    another brand's products in the window name those products instead.
+    A category named outside of such a window stands for all of its products.
+    """
+
+    def __init__(self, catalog):
+        self.version = catalog.version
+        self.products = catalog.products
+        self.products_and_category = catalog.products_and_category
+        self.automaton = TokenAutomaton()
+        self.brand_of = {}
+        self.brand_products = {}
+        self.variants = {}
+        generic = {token for synonyms in category_synonyms.values()
+                   for synonym in synonyms for token in tokenize(synonym)}
+
+        for name, product in catalog.products.items():
+            brand = tuple(tokenize(product['brand']))
+            name_tokens = tokenize(name)
+            self.automaton.add(name_tokens, ('product', name))
+            self.automaton.add(tokenize(product['model_number']), ('product', name))
+            self.brand_of[name] = brand
+            self.brand_products.setdefault(brand, []).append(product)
+            self.automaton.add(brand, ('brand', brand))
+            variants = {token for token in name_tokens if token not in brand and token not in generic}
+            self.variants[name] = variants
+            for token in variants:
+                self.automaton.add([token], ('variant', token))
+
+        for category, synonyms in category_synonyms.items():
+            for synonym in synonyms:
+                self.automaton.add(tokenize(synonym), ('category', category))
+        self.automaton.build()
+
+        # Deletion index for matching misspelled words with edit distance 1
+        self.vocabulary = {token for state in self.automaton.goto for token in state}
+        self.fuzzy_index = {}
+        for token in self.vocabulary:
+            if len(token) >= 4:
+                for key in deletions(token) | {token}:
+                    self.fuzzy_index.setdefault(key, set()).add(token)
+
+    def canonical_tokens(self, text):
+        """Tokens of the text mapped onto the catalog vocabulary."""
+        tokens = tokenize(text)
+        canonical = []
+        i = 0
+        while i < len(tokens):
+            # Joined neighbours, so that "pro phone" matches "ProPhone"
+            if i + 1 < len(tokens) and tokens[i] + tokens[i + 1] in self.vocabulary:
+                canonical.append(tokens[i] + tokens[i + 1])
+                i += 2
+                continue
+            canonical.append(self.correct(tokens[i]))
+            i += 1
+        return canonical
+
+    def correct(self, token):
+        if token in self.vocabulary or len(token) < 4:
+            return token
+        candidates = set()
+        for key in deletions(token) | {token}:
+            candidates |= self.fuzzy_index.get(key, set())
+        # Ambiguous corrections are left alone
+        return candidates.pop() if len(candidates) == 1 else token
+
+    def find_matches(self, tokens):
+        """Leftmost longest, non overlapping matches."""
+        matches = sorted(self.automaton.search(tokens), key=lambda match: (match[0], match[0] - match[1]))
+        chosen, end = [], 0
+        for start, stop, payload in matches:
+            if start >= end:
+                chosen.append(payload)
+                end = stop
+        return chosen
+
+    def resolve_brand(self, brand_products, window, categories):
+        """The products of a brand that the words after it point to."""
+        candidates = brand_products
+        in_category = [product for product in candidates if product['category'] in categories]
+        if in_category:
+            candidates = in_category
+        variants = {value for kind, value in window if kind == 'variant'}
+        chosen = [product for product in candidates if self.variants[product['name']] & variants]
+        return chosen or candidates
+
+    def resolve_keywords(self, words):
+        """
+        The products variant words name without their brand. Each word picks
+        the products sharing the most of the words, so "wireless charger"
+        is the charger and not the wireless earbuds.
+        """
+        found = []
+        for word in sorted(words):
+            if len(word) < min_keyword_length:
+                continue
+            overlap = {product['name']: len(self.variants[product['name']] & words)
+                       for product in self.products.values() if word in self.variants[product['name']]}
+            if overlap:
+                best = max(overlap.values())
+                found.extend(self.products[name] for name, count in overlap.items() if count == best)
+        return found
+
+    def brand_products_of(self, kind, value):
+        return self.brand_products[value if kind == 'brand' else self.brand_of[value]]
+
+    def extract_clause(self, text, found, whole_categories):
+        matches = self.find_matches(self.canonical_tokens(text))
+        # A category named before a brand of it ("headphones from audiophonic") only narrows the brand
+        anchored = {product['category'] for kind, value in matches if kind in ('brand', 'product')
+                    for product in self.brand_products_of(kind, value)}
+        i = 0
+        while i < len(matches):
+            kind, value = matches[i]
+            if kind in ('brand', 'product'):
+                brand_products = self.brand_products_of(kind, value)
+                brand_categories = {product['category'] for product in brand_products}
+                j = i + 1
+                while j < len(matches) and matches[j][0] not in ('brand', 'product'):
+                    j += 1
+                # Variant words of another brand ("the GS-X with the racing wheel") do not
+                # narrow this brand, they name their own products
+                own_variants = set().union(*(self.variants[product['name']] for product in brand_products))
+                window = [match for match in matches[i + 1:j]
+                          if match[0] != 'variant' or match[1] in own_variants]
+                foreign = {value for kind, value in matches[i + 1:j]
+                           if kind == 'variant' and value not in own_variants}
+                # Categories of other brands in the window still stand for the whole category
+                categories = {value for kind, value in window if kind == 'category' and value in brand_categories}
+                for other_kind, other_value in window:
+                    if other_kind == 'category' and other_value not in brand_categories:
+                        whole_categories.append(other_value)
+                if kind == 'product':
+                    found.append(self.products[value])
+                    variants = [match for match in window if match[0] == 'variant']
+                    if variants:
+                        found.extend(self.resolve_brand(brand_products, variants, categories))
+                else:
+                    found.extend(self.resolve_brand(brand_products, window, categories))
+                found.extend(self.resolve_keywords(foreign))
+                i = j
+                continue
+
+            if kind == 'category' and value not in anchored:
+                whole_categories.append(value)
+            elif kind == 'variant':
+                found.extend(self.resolve_keywords({value}))
+            i += 1
+
+    def extract(self, text):
+        found, whole_categories = [], []
+        for clause in clause_pattern.split(text):
+            self.extract_clause(clause, found, whole_categories)
+
+        result = {}
+        for category in whole_categories:
+            result[category] = list(self.products_and_category.get(category, []))
+        for product in found:
+            names = result.setdefault(product['category'], [])
+            if product['name'] not in names:
+                names.append(product['name'])
+        return [{'category': category, 'products': names} for category, names in result.items()]
+
+
+_extractor_lock = threading.Lock()
+_extractor = None
+
+
+def get_product_extractor():
+    global _extractor
+    catalog.refresh()
+    with _extractor_lock:
+        if _extractor is None or _extractor.version != catalog.version:
+            _extractor = ProductExtractor(catalog)
+        return _extractor
+
+
+def find_category_and_product_local(user_input):
+    """Same output as find_category_and_product_v2, or None when nothing is recognized."""
+    extracted = get_product_extractor().extract(user_input)
+    if not extracted:
+        return None
+    return json.dumps(extracted)
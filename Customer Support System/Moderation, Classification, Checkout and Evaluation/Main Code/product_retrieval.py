@@ -0,0 +1,162 @@
+# Retrieve only the catalog products that are relevant to a customer question
+import re, threading
+from catalog import catalog
+from prompt_budget import encode_products, encode_products_and_category
+
+# Words customers use for each category
+category_synonyms = {
+    "Computers and Laptops": ["computer", "laptop", "notebook", "pc"],
+    "Smartphones and Accessories": ["smartphone", "phone", "mobile", "cellphone"],
+    "Televisions and Home Theater Systems": ["tv", "television", "home theater", "home theatre"],
+    "Gaming Consoles and Accessories": ["console", "gaming", "game", "gamer"],
+    "Audio Equipment": ["audio", "headphone", "speaker", "music"],
+    "Cameras and Camcorders": ["camera", "camcorder", "videographer", "photographer", "photography"],
+}
+
+# Products listed per category when the question only names a category
+max_products_per_category = 10
+
+
+def normalize(text):
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def tokenize(text):
+    # Strip a plural "s" so that "tvs" matches "tv" and "cameras" matches "camera"
+    return [token[:-1] if len(token) > 2 and token.endswith("s") and not token.endswith("ss") else token
+            for token in normalize(text).split()]
+
+
+def joined_runs(words, longest):
+    """Every run of up to `longest` consecutive words, joined without spaces."""
+    return {"".join(words[start:end]) for start in range(len(words))
+            for end in range(start + 1, min(len(words), start + longest) + 1)}
+
+
+class ProductIndex:
+    """
+    Name tokens and rating order on top of the hash indexes of the catalog,
+    built once per catalog version so that a lookup does not scan the catalog.
+    """
+
+    def __init__(self, catalog):
+        self.version = catalog.version
+        self.products = catalog.products
+        self.by_brand = catalog.by_brand
+        self.by_model_number = catalog.by_model_number
+        self.by_category = {category: sorted(category_products, key=lambda product: product.get('rating', 0),
+                                             reverse=True)
+                            for category, category_products in catalog.by_category.items()}
+        self.name_tokens = {name: tokenize(name) for name in self.products}
+        # A name can be written with each of its words split in two, "pro phone" for "ProPhone"
+        self.longest_run = 2 * max((len(tokens) for tokens in self.name_tokens.values()), default=1)
+        self.generic_tokens = set()
+
+        for synonyms in category_synonyms.values():
+            for synonym in synonyms:
+                self.generic_tokens.update(tokenize(synonym))
+
+        # Matches are reported in catalog order whatever order the question names them in
+        self.position = {name: position for position, name in enumerate(self.products)}
+        self.by_joined_name = {"".join(tokens): self.products[name] for name, tokens in self.name_tokens.items()}
+        # Words of a name other than its brand and the category words, "ultrabook" or "charger"
+        self.distinctive = {}
+        self.by_distinctive_token = {}
+        for name, name_tokens in self.name_tokens.items():
+            brand = self.products[name]['brand'].lower()
+            self.distinctive[name] = [t for t in name_tokens if t != brand and t not in self.generic_tokens]
+            for token in self.distinctive[name]:
+                self.by_distinctive_token.setdefault(token, []).append(self.products[name])
+
+    def match_products(self, tokens, question):
+        """
+        Products named by the question. Returns (named, keyword) where named
+        products were matched by full name, brand or model number and keyword
+        products by a distinctive word such as "soundbar" or "charger".
+        Names and model numbers only match whole words of the question, the
+        runs and words of the question are looked up in the indexes built above.
+        """
+        token_set = set(tokens)
+        # Joined neighbours so that "pro phone" also matches "ProPhone"
+        token_set.update(a + b for a, b in zip(tokens, tokens[1:]))
+        runs = joined_runs(tokens, self.longest_run)
+        # Model numbers without the plural stripping, "gs-x", "gs x" and "gsx" all match GS-X
+        model_runs = joined_runs(normalize(question).split(), 4)
+
+        named = {self.by_joined_name[run]['name'] for run in runs if run in self.by_joined_name}
+        keyword = set()
+        candidates = {product['name'] for token in token_set
+                      for product in self.by_distinctive_token.get(token, [])}
+        for name in candidates - named:
+            brand = self.products[name]['brand'].lower()
+            if brand in token_set:
+                named.add(name)
+            elif any(len(t) >= 4 and t in token_set for t in self.distinctive[name]):
+                keyword.add(name)
+        by_model = {self.by_model_number[run]['name'] for run in model_runs if run in self.by_model_number}
+
+        # Model number matches come after the name matches
+        ordered = sorted(named, key=self.position.get) + sorted(by_model - named, key=self.position.get)
+        return ([self.products[name] for name in ordered],
+                [self.products[name] for name in sorted(keyword - named - by_model, key=self.position.get)])
+
+    def match_brands(self, tokens, matched):
+        """Products of brands that are mentioned without a specific product."""
+        matched_brands = {product['brand'].lower() for product in matched}
+        products = []
+        for token in set(tokens):
+            if token in self.by_brand and token not in matched_brands:
+                products.extend(self.by_brand[token])
+        return products
+
+    def match_categories(self, question, matched):
+        """Categories mentioned by the question that no named product already covers."""
+        text = " " + " ".join(tokenize(question)) + " "
+        covered = {product['category'] for product in matched}
+        categories = []
+        for category, synonyms in category_synonyms.items():
+            if category in covered:
+                continue
+            if any(" " + " ".join(tokenize(synonym)) + " " in text for synonym in synonyms):
+                categories.append(category)
+        return categories
+
+    def retrieve(self, question):
+        """Products relevant to the question, named products first."""
+        tokens = tokenize(question)
+        named, keyword = self.match_products(tokens, question)
+        named.extend(product for product in self.match_brands(tokens, named) if product not in named)
+
+        products = named + keyword
+        for category in self.match_categories(question, named):
+            for product in self.by_category.get(category, [])[:max_products_per_category]:
+                if product not in products:
+                    products.append(product)
+        return products
+
+
+_index_lock = threading.Lock()
+_product_index = None
+
+
+def get_product_index():
+    """The product index of the current catalog, rebuilt after the catalog file changes."""
+    global _product_index
+    catalog.refresh()
+    with _index_lock:
+        if _product_index is None or _product_index.version != catalog.version:
+            _product_index = ProductIndex(catalog)
+        return _product_index
+
+
+def get_relevant_product_context(question):
+    """Text block with the products relevant to the question, ready for a system message."""
+    product_index = get_product_index()
+    products = product_index.retrieve(question)
+    print(f"\nRetrieved {len(products)} relevant products")
+    if not products:
+        # Best rated product names per category, when no product or category is recognized
+        names = {category: [product['name'] for product in category_products]
+                 for category, category_products in product_index.by_category.items()}
+        return encode_products_and_category(names, limit=max_products_per_category)
+    return encode_products(products)
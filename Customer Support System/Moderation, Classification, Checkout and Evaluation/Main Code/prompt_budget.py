@@ -0,0 +1,126 @@
+# Prompt token accounting, a size cap and compact catalog encodings for the prompts
+# Print the cost of the prompt templates with: python prompt_budget.py ["customer question"]
+import os, sys, threading
+import shared_modules
+from metrics import current_span
+from token_count import count_tokens, message_tokens
+
+# Prompts estimated above this many tokens are not sent
+max_prompt_tokens = int(os.getenv("PROMPT_MAX_TOKENS", "3000"))
+
+catalog_fields = "id | name | brand | model | warranty | rating | price | features | description"
+
+
+class PromptTooLarge(ValueError):
+    """A prompt above the token cap."""
+
+
+def product_ids(products):
+    """Short ids P1, P2, ... in catalog order."""
+    return {product['name']: f"P{number}" for number, product in enumerate(products, 1)}
+
+
+def encode_products(products, ids=None):
+    """
+    Products as one line each under a header per category, with the field
+    names given once instead of per product as in the dict repr.
+    """
+    ids = ids or product_ids(products)
+    by_category = {}
+    for product in products:
+        by_category.setdefault(product['category'], []).append(product)
+
+    lines = [f"Fields: {catalog_fields}"]
+    for category, category_products in by_category.items():
+        lines.append(f"# {category}")
+        for product in category_products:
+            lines.append(" | ".join([
+                ids[product['name']], product['name'], product['brand'], product['model_number'],
+                product['warranty'], str(product['rating']), f"${product['price']}",
+                "; ".join(product['features']), product['description'],
+            ]))
+    return "\n".join(lines)
+
+
+def encode_products_and_category(products_and_category, limit=None):
+    """Product names per category, one line per category."""
+    return "\n".join(f"{category}: {'; '.join(names[:limit])}"
+                     for category, names in products_and_category.items())
+
+
+class PromptBudget:
+    """
+    Counts the tokens of every prompt before it is sent and rejects the
+    ones above max_tokens. Counts are kept per pipeline stage.
+    """
+
+    def __init__(self, max_tokens=max_prompt_tokens):
+        self.max_tokens = max_tokens
+        self.lock = threading.Lock()
+        self.largest = {}
+        self.rejected = 0
+
+    def check(self, messages, name=None):
+        """Token estimate of the messages, raises PromptTooLarge above the cap."""
+        span = current_span.get()
+        name = name or (span['stage'] if span else "other")
+        tokens = message_tokens(messages)
+        with self.lock:
+            self.largest[name] = max(self.largest.get(name, 0), tokens)
+            if tokens > self.max_tokens:
+                self.rejected += 1
+        if tokens > self.max_tokens:
+            raise PromptTooLarge(f"Prompt of {name} has about {tokens} tokens, the cap is {self.max_tokens}")
+        return tokens
+
+    def fits(self, messages):
+        """Whether the messages are within the cap, for callers that can shrink their prompt."""
+        return message_tokens(messages) <= self.max_tokens
+
+    def stats(self):
+        with self.lock:
+            return {'largest': dict(self.largest), 'rejected': self.rejected}
+
+
+def report(messages, components=None):
+    """
+    Token cost of a prompt split into its components, e.g. the product
+    context, with the fixed template text as the remainder.
+    """
+    total = message_tokens(messages)
+    costs = {name: count_tokens(text) for name, text in (components or {}).items()}
+    return dict(costs, template=total - sum(costs.values()), total=total)
+
+
+def print_report(name, messages, components=None):
+    costs = report(messages, components)
+    parts = ", ".join(f"{component} {tokens}" for component, tokens in costs.items() if component != 'total')
+    print(f"{name}: {costs['total']} tokens ({parts})")
+
+
+prompt_budget = PromptBudget()
+
+
+if __name__ == '__main__':
+    import support_pipeline
+    from catalog import catalog
+    from product_retrieval import get_relevant_product_context
+
+    question = sys.argv[1] if len(sys.argv) > 1 else "tell me about the smartx pro phone and the fotosnap camera"
+    products = list(catalog.get_products().values())
+    products_and_category = catalog.get_products_and_category()
+    product_context = get_relevant_product_context(question)
+
+    print("Catalog encodings:")
+    print(f"  products repr {count_tokens(repr(catalog.get_products()))}, compact {count_tokens(encode_products(products))}")
+    print(f"  products_and_category repr {count_tokens(repr(products_and_category))}, "
+          f"compact {count_tokens(encode_products_and_category(products_and_category))}")
+
+    print(f"Prompt templates (cap {prompt_budget.max_tokens}):")
+    print_report("  prompt_injection", support_pipeline.prompt_injection_messages(question, "en"), {'question': question})
+    print_report("  classification", support_pipeline.classification_messages(question), {'question': question})
+    print_report("  cot_answer", support_pipeline.chain_of_thought_messages(question),
+                 {'question': question, 'product_context': product_context})
+    product_information = encode_products(products)
+    print_report("  output_check (whole catalog)", support_pipeline.output_check_messages(question, "", products),
+                 {'question': question, 'product_information': product_information})
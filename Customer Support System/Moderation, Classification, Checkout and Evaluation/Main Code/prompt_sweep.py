@@ -0,0 +1,91 @@
+# Runs several prompt variants over the same dataset and compares accuracy, latency and tokens
+# Run with: python prompt_sweep.py [dataset.jsonl] [variant ...]
+# e.g.      LLM_CASSETTE_MODE=record python prompt_sweep.py data/evaluation/product_extraction_dev.jsonl v1 v2
+import math, sys
+from cassette import cassette
+from eval_runner import EvalRunner, default_case_id
+from local_models import read_jsonl
+
+default_dataset = "./data/evaluation/product_extraction_dev.jsonl"
+
+
+def percentile(values, fraction):
+    """Nearest rank percentile, fraction=0.95 for p95."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def sweep(cases, variants, score, **options):
+    """
+    Scores every case with every variant in one concurrent run, with
+    score(variant, case) -> score. Returns the results per variant,
+    in the order of the cases. The completion cache is bypassed, a
+    cassette in replay mode still answers from the recording.
+    """
+    pairs = [(name, case) for name in variants for case in cases]
+
+    def evaluate(pair):
+        name, case = pair
+        return score(variants[name], case)
+
+    def case_id(pair):
+        name, case = pair
+        return f"{name}:{default_case_id(case)}"
+
+    # A completion cache hit has no latency and no tokens, so the sweep always calls the model
+    use_cache, cassette.use_cache = cassette.use_cache, False
+    try:
+        runner = EvalRunner(cassette.measure(evaluate), case_id=case_id, **options)
+        results, _ = runner.run(pairs)
+    finally:
+        cassette.use_cache = use_cache
+    return {name: results[i * len(cases):(i + 1) * len(cases)] for i, name in enumerate(variants)}
+
+
+def variant_summary(results):
+    scores = [result['score'] if result.get('score') is not None else 0 for result in results]
+    # The LLM latency is the recorded one when replaying, so variants compare the same offline
+    latencies = [result.get('llm_seconds', result['seconds']) for result in results]
+    return {
+        'accuracy': sum(scores) / len(scores) if scores else 0.0,
+        'failed': sum(1 for result in results if result.get('score') is None),
+        'mean_latency': sum(latencies) / len(latencies) if latencies else 0.0,
+        'p95_latency': percentile(latencies, 0.95),
+        'prompt_tokens': sum(result.get('prompt_tokens', 0) for result in results),
+        'completion_tokens': sum(result.get('completion_tokens', 0) for result in results),
+        'llm_calls': sum(result.get('llm_calls', 0) for result in results),
+    }
+
+
+def print_sweep(cases, results):
+    print(f"{'variant':<10}{'accuracy':>10}{'failed':>8}{'mean s':>9}{'p95 s':>9}"
+          f"{'prompt tok':>12}{'compl tok':>11}{'calls':>7}")
+    for name, variant_results in results.items():
+        summary = variant_summary(variant_results)
+        print(f"{name:<10}{summary['accuracy']:>10.3f}{summary['failed']:>8}{summary['mean_latency']:>9.2f}"
+              f"{summary['p95_latency']:>9.2f}{summary['prompt_tokens']:>12}{summary['completion_tokens']:>11}"
+              f"{summary['llm_calls']:>7}")
+
+    # Per case diff, only the cases the variants do not agree on
+    names = list(results)
+    differing = 0
+    for index, case in enumerate(cases):
+        scores = [results[name][index].get('score') for name in names]
+        if len(set(scores)) > 1:
+            differing += 1
+            cells = ", ".join(f"{name} {score if score is not None else 'failed'}"
+                              for name, score in zip(names, scores))
+            print(f"{case.get('id', index)}: {cells} | {' '.join(case['customer_msg'].split())[:60]}")
+    print(f"{differing} of {len(cases)} cases scored differently")
+
+
+if __name__ == '__main__':
+    from evaluation_part_1 import extractor_variants, score_variant
+    dataset = sys.argv[1] if len(sys.argv) > 1 else default_dataset
+    names = sys.argv[2:] or list(extractor_variants)
+    cases = list(read_jsonl(dataset))
+    results = sweep(cases, {name: extractor_variants[name] for name in names}, score_variant)
+    print_sweep(cases, results)
+    print(cassette.report())
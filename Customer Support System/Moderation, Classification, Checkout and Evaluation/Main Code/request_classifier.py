@@ -0,0 +1,87 @@
+# Local service request classifier trained on logged LLM labels
+import json, os, sys
+from local_models import NaiveBayes, extract_features, append_jsonl, read_jsonl
+
+labels_file = "./data/classification_labels.jsonl"
+model_file = "./data/request_classifier.json"
+
+# Predictions below this confidence are sent to the LLM instead
+min_confidence = float(os.getenv("CLASSIFIER_MIN_CONFIDENCE", "0.8"))
+
+# Primary and secondary categories of the service request taxonomy
+categories = {
+    "Billing": ["Unsubscribe or upgrade", "Add a payment method",
+                "Explanation for charge", "Dispute a charge"],
+    "Technical Support": ["General troubleshooting", "Device compatibility",
+                          "Software updates"],
+    "Account Management": ["Password reset", "Update personal information",
+                           "Close account", "Account security"],
+    "General Inquiry": ["Product information", "Pricing", "Feedback",
+                        "Speak to a human"],
+}
+
+label_separator = " / "
+
+
+def parse_classification(response):
+    """Parse the LLM json answer, returning None if it is not in the taxonomy."""
+    try:
+        data = json.loads(response[response.index("{"):response.rindex("}") + 1])
+    except (ValueError, AttributeError):
+        return None
+    primary, secondary = data.get('primary'), data.get('secondary')
+    if secondary not in categories.get(primary, []):
+        return None
+    return {'primary': primary, 'secondary': secondary}
+
+
+def log_label(question, classification):
+    """Keep the LLM label so that the local classifier can be retrained on it."""
+    append_jsonl(labels_file, {'question': question, **classification})
+
+
+class RequestClassifier:
+    """Predicts the primary and secondary category as one joint label."""
+
+    def __init__(self, model=None, min_confidence=min_confidence):
+        self.model = model
+        self.min_confidence = min_confidence
+
+    def classify(self, question):
+        """Return the classification dict, or None when the LLM should decide."""
+        if self.model is None:
+            return None
+        probabilities = self.model.predict_proba(extract_features(question))
+        label, confidence = max(probabilities.items(), key=lambda item: item[1])
+        print(f"\nLocal classification {label} ({confidence:.2f})")
+        if confidence < self.min_confidence:
+            return None
+        primary, secondary = label.split(label_separator)
+        return {'primary': primary, 'secondary': secondary, 'confidence': round(confidence, 3)}
+
+
+def train(path=labels_file, output=model_file):
+    examples = [(extract_features(record['question']),
+                 record['primary'] + label_separator + record['secondary'])
+                for record in read_jsonl(path)]
+    if not examples:
+        print(f"No labels found in {path}")
+        return None
+    model = NaiveBayes().train(examples)
+    model.save(output)
+    print(f"Trained request classifier on {len(examples)} labels, saved to {output}")
+    return model
+
+
+def load_classifier():
+    model = NaiveBayes.load(model_file) if os.path.exists(model_file) else None
+    return RequestClassifier(model)
+
+
+request_classifier = load_classifier()
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'train':
+        train()
+    else:
+        print("Usage: python request_classifier.py train")
@@ -0,0 +1,92 @@
+# Replay, miss and record mechanics of the cassette, no API key or network needed
+# Run from Main Code with: python -m unittest discover tests
+import os, shutil, sys, tempfile, time, unittest
+
+main_code = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, main_code)
+os.chdir(main_code)
+
+import evaluation_part_1
+from cassette import Cassette, CassetteMiss
+from local_models import read_jsonl
+
+dataset = "./data/evaluation/product_extraction_dev.jsonl"
+# Synthetic: the responses were written by hand from the ideal answers, not recorded from the model,
+# and every call is given 0.5s of latency. It only exercises the cassette, not the prompts.
+synthetic_cassette = "./tests/fixtures/synthetic_extraction_cassette.jsonl"
+synthetic_seconds = 0.5
+
+
+class CassetteReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.recording = evaluation_part_1.cassette
+        self.cases = list(read_jsonl(dataset))
+        self.records = {record['key']: record for record in read_jsonl(synthetic_cassette)}
+
+    def tearDown(self):
+        evaluation_part_1.cassette = self.recording
+
+    def use(self, cassette):
+        # The extractors resolve the cassette at call time, so another one can be swapped in
+        evaluation_part_1.cassette = cassette
+        return cassette
+
+    def score(self, cassette, name, case):
+        return cassette.measure(lambda case: evaluation_part_1.score_variant(
+            evaluation_part_1.extractor_variants[name], case))(case)
+
+    def test_replay_reports_the_recorded_usage_and_latency(self):
+        cassette = self.use(Cassette(synthetic_cassette, "replay"))
+        started = time.perf_counter()
+        results = [self.score(cassette, name, case) for name in ('v1', 'v2') for case in self.cases]
+        self.assertLess(time.perf_counter() - started, 1.0)
+
+        self.assertEqual(cassette.counts['replayed'], 2 * len(self.cases))
+        self.assertEqual(cassette.counts['live'] + cassette.counts['recorded'], 0)
+        self.assertEqual(cassette.counts['prompt_tokens'],
+                         sum(record['usage']['prompt_tokens'] for record in self.records.values()))
+        for result in results:
+            self.assertEqual(result['llm_calls'], 1)
+            # The latency of the recorded call, not the time the replay took
+            self.assertEqual(result['llm_seconds'], synthetic_seconds)
+
+    def test_changed_prompt_is_a_miss_when_replaying(self):
+        cassette = self.use(Cassette(synthetic_cassette, "replay"))
+        case = dict(self.cases[0], customer_msg=self.cases[0]['customer_msg'] + " Thanks!")
+        with self.assertRaises(CassetteMiss):
+            evaluation_part_1.score_variant(evaluation_part_1.extractor_variants['v2'], case)
+        self.assertEqual(cassette.counts['calls'], 0)
+
+    def test_lenient_replay_ignores_case_and_whitespace(self):
+        cassette = self.use(Cassette(synthetic_cassette, "lenient"))
+        case = dict(self.cases[0], customer_msg=self.cases[0]['customer_msg'].upper().replace(" ", "  "))
+        evaluation_part_1.score_variant(evaluation_part_1.extractor_variants['v2'], case)
+        self.assertEqual(cassette.counts['replayed'], 1)
+
+    def test_record_appends_new_requests_once(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "cassette.jsonl")
+        calls = []
+
+        def create():
+            calls.append(1)
+            return "[]"
+
+        messages = [{'role': 'user', 'content': "Which TVs do you have?"}]
+        recorder = Cassette(path, "record")
+        for _ in range(2):
+            self.assertEqual(recorder.play(create, messages, "gpt-3.5-turbo", 0, 10), "[]")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(recorder.counts['recorded'], 1)
+        self.assertEqual(recorder.counts['replayed'], 1)
+        self.assertEqual(len(list(read_jsonl(path))), 1)
+
+        replayer = Cassette(path, "replay")
+        self.assertEqual(replayer.play(create, messages, "gpt-3.5-turbo", 0, 10), "[]")
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+# Local product extraction over the catalog, no API key or network needed
+# Run from Main Code with: python -m unittest discover tests
+import json, os, sys, unittest
+
+main_code = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, main_code)
+os.chdir(main_code)
+
+from product_extractor import find_category_and_product_local
+
+
+def extracted_products(question):
+    return {name for entry in json.loads(find_category_and_product_local(question) or "[]")
+            for name in entry['products']}
+
+
+class ProductExtractorTest(unittest.TestCase):
+
+    def test_variant_words_narrow_their_own_brand(self):
+        self.assertEqual(extracted_products("tell me about the fotosnap camera, the dslr one"),
+                         {"FotoSnap DSLR Camera"})
+
+    def test_product_with_an_accessory_of_another_brand(self):
+        self.assertEqual(extracted_products("Is the GS-X compatible with the racing wheel?"),
+                         {"GameSphere X", "ProGamer Racing Wheel"})
+        self.assertEqual(extracted_products("Does the SmartX ProPhone work with the wireless charger?"),
+                         {"SmartX ProPhone", "MobiTech Wireless Charger"})
+
+    def test_product_with_a_category_word_of_other_brands(self):
+        self.assertEqual(extracted_products("Is the CineView 8K TV compatible with the soundbar?"),
+                         {"CineView 8K TV", "SoundMax Soundbar", "WaveSound Soundbar"})
+        self.assertEqual(extracted_products("Compare the TechPro Ultrabook and the chromebook"),
+                         {"TechPro Ultrabook", "BlueWave Chromebook"})
+
+    def test_brand_with_an_accessory_of_another_brand(self):
+        found = extracted_products("Does the SmartX work with the wireless charger?")
+        self.assertIn("MobiTech Wireless Charger", found)
+        self.assertNotIn("AudioPhonic True Wireless Earbuds", found)
+
+
+if __name__ == '__main__':
+    unittest.main()
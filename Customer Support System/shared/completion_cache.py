@@ -0,0 +1,135 @@
+# Two tier cache for deterministic (temperature 0) chat completions
+import hashlib, json, os, sqlite3, threading, time
+from collections import OrderedDict
+
+cache_file = os.getenv("COMPLETION_CACHE_FILE", "./data/completion_cache.sqlite3")
+
+
+class CompletionCache:
+    """
+    In-memory LRU tier in front of an on-disk SQLite tier.
+    Disk entries expire after ttl_seconds and the least recently used
+    entries are evicted once the disk tier holds more than max_disk_entries.
+    """
+
+    def __init__(self, path=cache_file, max_memory_entries=1024,
+                 max_disk_entries=100000, ttl_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS completions (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            used_at REAL NOT NULL)""")
+        self.db.commit()
+
+    @staticmethod
+    def make_key(model, messages, temperature, max_tokens, response_format=None):
+        # A response format is only part of the key when it is set, the other keys stay the same
+        request = [model, messages, temperature, max_tokens] + ([response_format] if response_format else [])
+        payload = json.dumps(request, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            if key in self.memory:
+                value, created_at = self.memory[key]
+                if now - created_at <= self.ttl_seconds:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.memory[key]
+
+            row = self.db.execute("SELECT value, created_at FROM completions WHERE key = ?",
+                                  (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self.db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                    self.db.commit()
+                self.misses += 1
+                return None
+
+            self.db.execute("UPDATE completions SET used_at = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            self._remember(key, row[0], row[1])
+            self.hits += 1
+            self.disk_hits += 1
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self.lock:
+            self._remember(key, value, now)
+            self.db.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                            (key, value, now, now))
+            self._evict(now)
+            self.db.commit()
+
+    def _remember(self, key, value, created_at):
+        self.memory[key] = (value, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def _evict(self, now):
+        self.db.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl_seconds,))
+        count = self.db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        if count > self.max_disk_entries:
+            self.db.execute("""DELETE FROM completions WHERE key IN (
+                SELECT key FROM completions ORDER BY used_at LIMIT ?)""",
+                            (count - self.max_disk_entries,))
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.db.execute("DELETE FROM completions")
+            self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'memory_hits': self.hits - self.disk_hits,
+                'disk_hits': self.disk_hits,
+                'memory_entries': len(self.memory),
+            }
+
+
+completion_cache = CompletionCache(
+    max_memory_entries=int(os.getenv("COMPLETION_CACHE_MEMORY_ENTRIES", "1024")),
+    max_disk_entries=int(os.getenv("COMPLETION_CACHE_DISK_ENTRIES", "100000")),
+    ttl_seconds=float(os.getenv("COMPLETION_CACHE_TTL", str(7 * 24 * 3600))),
+)
+
+
+def cached_completion(create, messages, model, temperature, max_tokens, on_hit=None, response_format=None):
+    """
+    Return the completion for the request, calling create() only on a miss.
+    Only temperature 0 completions are cached since others are not repeatable.
+    """
+    if temperature != 0:
+        return create()
+
+    key = CompletionCache.make_key(model, messages, temperature, max_tokens, response_format)
+    content = completion_cache.get(key)
+    if content is None:
+        content = create()
+        if content is not None:
+            completion_cache.set(key, content)
+    elif on_hit is not None:
+        on_hit()
+    return content
@@ -0,0 +1,170 @@
+# Background jobs for the LLM pipelines, persisted in SQLite
+import json, os, sqlite3, threading, time, uuid
+
+jobs_file = os.getenv("JOBS_FILE", "./data/jobs.sqlite3")
+
+# Worker threads per process, and seconds finished jobs are kept
+job_workers = int(os.getenv("JOB_WORKERS", "4"))
+job_retention = float(os.getenv("JOB_RETENTION_SECONDS", str(24 * 3600)))
+
+# Running jobs without an update for this long were left behind by a crashed process
+stale_after = float(os.getenv("JOB_STALE_SECONDS", "600"))
+
+# Seconds between checks for new jobs and new results
+poll_interval = 0.2
+
+# Seconds an event stream stays open, a request thread of the server is held all that time
+events_timeout = float(os.getenv("JOB_EVENTS_SECONDS", "20"))
+
+
+class JobQueue:
+    """
+    Jobs are rows of a SQLite table, so queued jobs survive a restart and
+    several processes can share the queue. Worker threads claim the oldest
+    queued job, run the handler registered for its kind and store every
+    partial result the handler reports, so clients can poll or stream
+    them while the job is still running.
+    """
+
+    def __init__(self, path=jobs_file, workers=job_workers, retention=job_retention):
+        self.path = path
+        self.workers = workers
+        self.retention = retention
+        self.handlers = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.threads = []
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            status TEXT NOT NULL,
+            results TEXT NOT NULL,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self.db.commit()
+
+    def register(self, kind, handler):
+        """handler(params, update) runs a job, update(key, value) stores a partial result."""
+        self.handlers[kind] = handler
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            # Jobs of a crashed process are run again
+            self.db.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated_at < ?",
+                            (time.time() - stale_after,))
+            self.db.commit()
+            for number in range(self.workers):
+                thread = threading.Thread(target=self.work, name=f"job-worker-{number}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, kind, params):
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for jobs of kind {kind}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT INTO jobs VALUES (?, ?, ?, 'queued', '{}', NULL, ?, ?)",
+                            (job_id, kind, json.dumps(params), now, now))
+            self.db.commit()
+        self.start()
+        self.wakeup.set()
+        return job_id
+
+    def claim(self):
+        """The oldest queued job, marked as running, or None."""
+        with self.lock:
+            rows = self.db.execute("SELECT id, kind, params FROM jobs WHERE status = 'queued' "
+                                   "ORDER BY created_at LIMIT 8").fetchall()
+            for job_id, kind, params in rows:
+                # Another process may have claimed the job since it was read
+                claimed = self.db.execute("UPDATE jobs SET status = 'running', updated_at = ? "
+                                          "WHERE id = ? AND status = 'queued'", (time.time(), job_id)).rowcount
+                self.db.commit()
+                if claimed:
+                    return job_id, kind, json.loads(params)
+        return None
+
+    def update(self, job_id, key, value):
+        with self.lock:
+            row = self.db.execute("SELECT results FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            results = json.loads(row[0])
+            results[key] = value
+            self.db.execute("UPDATE jobs SET results = ?, updated_at = ? WHERE id = ?",
+                            (json.dumps(results), time.time(), job_id))
+            self.db.commit()
+
+    def finish(self, job_id, error=None):
+        with self.lock:
+            self.db.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                            ('failed' if error else 'done', error, time.time(), job_id))
+            self.db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                            (time.time() - self.retention,))
+            self.db.commit()
+
+    def work(self):
+        while True:
+            job = self.claim()
+            if job is None:
+                self.wakeup.wait(poll_interval * 5)
+                self.wakeup.clear()
+                continue
+            job_id, kind, params = job
+            try:
+                self.handlers[kind](params, lambda key, value: self.update(job_id, key, value))
+                self.finish(job_id)
+            except Exception as exception:
+                print(f"Job {job_id} ({kind}) failed: {type(exception).__name__}: {exception}")
+                self.finish(job_id, f"{type(exception).__name__}: {exception}")
+
+    def get(self, job_id):
+        """Status and partial results of the job, None for an unknown id."""
+        with self.lock:
+            row = self.db.execute("SELECT kind, status, results, error, created_at, updated_at FROM jobs "
+                                  "WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        kind, status, results, error, created_at, updated_at = row
+        return {'id': job_id, 'kind': kind, 'status': status, 'results': json.loads(results),
+                'error': error, 'seconds': round(updated_at - created_at, 3)}
+
+    def events(self, job_id, timeout=events_timeout):
+        """
+        (event, data) pairs: every new or changed result, then the final status.
+        A job still running after `timeout` seconds ends the stream without a
+        final status, EventSource clients reconnect and get its results again.
+        """
+        sent = {}
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.get(job_id)
+            if job is None:
+                yield 'error', "unknown job"
+                return
+            for key, value in job['results'].items():
+                if sent.get(key) != value:
+                    sent[key] = value
+                    yield 'result', {'key': key, 'value': value}
+            if job['status'] in ('done', 'failed'):
+                yield job['status'], job['error'] or ""
+                return
+            time.sleep(poll_interval)
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'failed')}
+
+
+job_queue = JobQueue()
@@ -0,0 +1,85 @@
+# Pooled OpenAI clients with timeouts and a limit on in-flight requests
+import asyncio, os, threading
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+# Seconds to wait for a response and for a new connection
+request_timeout = float(os.getenv("OPENAI_TIMEOUT", "60"))
+connect_timeout = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+
+# Size of the HTTP/2 connection pool and maximum concurrent OpenAI requests
+max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+max_in_flight = int(os.getenv("OPENAI_MAX_IN_FLIGHT", "64"))
+max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max_in_flight)
+_client = None
+_async_client = None
+_async_slots = None
+
+
+def _http_options():
+    return {
+        'http2': True,
+        'timeout': httpx.Timeout(request_timeout, connect=connect_timeout),
+        'limits': httpx.Limits(max_connections=max_connections,
+                               max_keepalive_connections=max_connections),
+    }
+
+
+def get_client():
+    """OpenAI client shared by all threads, reusing its HTTP/2 connections."""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                max_retries=max_retries,
+                http_client=httpx.Client(**_http_options()),
+            )
+        return _client
+
+
+def create_chat_completion(**kwargs):
+    with _slots:
+        return get_client().chat.completions.create(**kwargs)
+
+
+def create_moderation(**kwargs):
+    with _slots:
+        return get_client().moderations.create(**kwargs)
+
+
+def get_async_client():
+    """AsyncOpenAI client shared by all handlers of the event loop."""
+    global _async_client, _async_slots
+    if _async_client is None:
+        _async_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            max_retries=max_retries,
+            http_client=httpx.AsyncClient(**_http_options()),
+        )
+        _async_slots = asyncio.Semaphore(max_in_flight)
+    return _async_client
+
+
+async def acreate_chat_completion(**kwargs):
+    client = get_async_client()
+    async with _async_slots:
+        return await client.chat.completions.create(**kwargs)
+
+
+async def acreate_moderation(**kwargs):
+    client = get_async_client()
+    async with _async_slots:
+        return await client.moderations.create(**kwargs)
+
+
+async def aclose():
+    """Close the async connection pool, called when the server shuts down."""
+    global _async_client, _async_slots
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+        _async_slots = None
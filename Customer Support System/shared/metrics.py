@@ -0,0 +1,153 @@
+# Per-stage latency and token metrics, exported in the Prometheus text format
+import asyncio, contextvars, functools, threading, time
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+token_buckets = (10, 50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+# Span of the stage that is running in the current thread or task
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class StageMetrics:
+    """
+    Wall time, prompt and completion tokens, cache hits, errors and
+    guardrail blocks of every pipeline stage. Token counts come from response.usage of the LLM calls
+    made while the stage is running.
+    """
+
+    def __init__(self, prefix="support"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.prompt_tokens = {}
+        self.completion_tokens = {}
+        self.llm_calls = {}
+        self.cache_hits = {}
+        self.errors = {}
+        self.blocked = {}
+
+    def start(self, name):
+        span = {'stage': name, 'start': time.perf_counter(), 'prompt_tokens': 0,
+                'completion_tokens': 0, 'llm_calls': 0, 'cache_hits': 0}
+        return span, current_span.set(span)
+
+    def finish(self, span, token, failed, blocked=False):
+        try:
+            current_span.reset(token)
+        except ValueError:
+            # Streaming responses may finish in a different context than they started
+            pass
+        span['seconds'] = time.perf_counter() - span['start']
+        name = span['stage']
+        with self.lock:
+            self.latency.setdefault(name, Histogram(latency_buckets)).observe(span['seconds'])
+            self.prompt_tokens.setdefault(name, Histogram(token_buckets)).observe(span['prompt_tokens'])
+            self.completion_tokens.setdefault(name, Histogram(token_buckets)).observe(span['completion_tokens'])
+            self.llm_calls[name] = self.llm_calls.get(name, 0) + span['llm_calls']
+            self.cache_hits[name] = self.cache_hits.get(name, 0) + span['cache_hits']
+            if failed:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            if blocked:
+                self.blocked[name] = self.blocked.get(name, 0) + 1
+
+    def timed(self, name):
+        """Decorator that records a span for each call of a sync or async stage function."""
+        def decorator(function):
+            if asyncio.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args, **kwargs):
+                    span, token = self.start(name)
+                    failed = True
+                    try:
+                        result = await function(*args, **kwargs)
+                        failed = False
+                        return result
+                    finally:
+                        self.finish(span, token, failed)
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                span, token = self.start(name)
+                failed = True
+                try:
+                    result = function(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    self.finish(span, token, failed)
+            return wrapper
+        return decorator
+
+    def render(self, gauges=None):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for metric, help_text, histograms in [
+                ("stage_duration_seconds", "Wall time of each pipeline stage", self.latency),
+                ("stage_prompt_tokens", "Prompt tokens used per stage call", self.prompt_tokens),
+                ("stage_completion_tokens", "Completion tokens used per stage call", self.completion_tokens),
+            ]:
+                name = f"{self.prefix}_{metric}"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for stage, histogram in sorted(histograms.items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+
+            for metric, help_text, counters in [
+                ("stage_llm_calls_total", "LLM requests sent by each stage", self.llm_calls),
+                ("stage_cache_hits_total", "Completions served from the cache by each stage", self.cache_hits),
+                ("stage_errors_total", "Stage calls that raised an exception", self.errors),
+                ("stage_blocked_total", "Stage calls stopped because the guardrails blocked the question", self.blocked),
+            ]:
+                name = f"{self.prefix}_{metric}"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for stage, value in sorted(counters.items()):
+                    lines.append(f'{name}{{stage="{stage}"}} {value}')
+
+        for metric, value in sorted((gauges or {}).items()):
+            name = f"{self.prefix}_{metric}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def record_usage(usage):
+    """Add the token usage of an LLM response to the running stage."""
+    span = current_span.get()
+    if span is None:
+        return
+    span['llm_calls'] += 1
+    if usage is not None:
+        span['prompt_tokens'] += usage.prompt_tokens or 0
+        span['completion_tokens'] += usage.completion_tokens or 0
+
+
+def record_cache_hit():
+    span = current_span.get()
+    if span is not None:
+        span['cache_hits'] += 1
+
+
+metrics = StageMetrics()
+timed_stage = metrics.timed
@@ -0,0 +1,32 @@
+# Offline token counts of prompts and texts, shared by both apps
+import re
+
+# Pieces the way BPE tokenizers pre-split text: contractions, words with their
+# leading space, groups of up to 3 digits, punctuation runs and whitespace
+piece_pattern = re.compile(r"'(?:s|t|re|ve|m|ll|d)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+")
+
+# Tokens added per chat message and for the reply, as counted by the API
+message_overhead = 4
+reply_overhead = 3
+
+
+def count_tokens(text):
+    """
+    Offline estimate of the BPE token count of the text. Common words are
+    one token, longer words take one token per 4 characters.
+    """
+    tokens = 0
+    for piece in piece_pattern.findall(text):
+        word = piece.strip()
+        if not word:
+            # A run of whitespace is one token, a single space joins the next word
+            tokens += 0 if piece == " " else 1
+        elif word.isalpha():
+            tokens += 1 if len(word) <= 7 else (len(word) + 3) // 4
+        else:
+            tokens += (len(word) + 1) // 2 if not word.isdigit() else 1
+    return tokens
+
+
+def message_tokens(messages):
+    return sum(count_tokens(message['content']) + message_overhead for message in messages) + reply_overhead
@@ -0,0 +1,188 @@
+# Translation of several texts into several languages in one structured request
+# Shared by both apps, the cache file is relative to the data directory of the running app
+import asyncio, hashlib, json, os
+from completion_cache import CompletionCache
+from token_count import count_tokens
+
+translation_cache_file = os.getenv("TRANSLATION_CACHE_FILE", "./data/translation_cache.sqlite3")
+
+# Completion tokens allowed for one request, larger batches are split into several requests
+max_request_tokens = int(os.getenv("TRANSLATION_MAX_TOKENS", "3000"))
+
+# Language codes of the forms
+language_names = {
+    "en": "English", "es": "Spanish", "fr": "French", "de": "German", "hi": "Hindi",
+    "gu": "Gujarati", "zh": "Chinese", "ja": "Japanese", "mr": "Marathi",
+}
+
+# Tokens of a translation per token of the english text. Latin scripts need a little
+# more, Devanagari (Hindi, Marathi) and Gujarati are split into many more tokens.
+script_token_factors = {"hi": 6, "mr": 6, "gu": 8, "zh": 2, "ja": 3}
+default_token_factor = 2
+
+# Translations do not change, so they are kept much longer than completions
+translation_cache = CompletionCache(
+    translation_cache_file,
+    max_memory_entries=int(os.getenv("TRANSLATION_CACHE_MEMORY_ENTRIES", "4096")),
+    ttl_seconds=float(os.getenv("TRANSLATION_CACHE_TTL", str(90 * 24 * 3600))),
+)
+
+
+def translation_key(text, language):
+    return hashlib.sha256(json.dumps([language, text]).encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(text, language):
+    """Completion tokens to reserve for the translation of text into language."""
+    return count_tokens(text) * script_token_factors.get(language, default_token_factor) + 20
+
+
+def truncated(translation, max_tokens):
+    """A translation that used up its max_tokens was most likely cut off."""
+    return count_tokens(translation) >= max_tokens - 1
+
+
+def batch_translation_messages(texts, batch):
+    """batch maps the index of a text to the languages it is translated into."""
+    items = [{'id': str(index), 'text': texts[index], 'languages': languages}
+             for index, languages in batch.items()]
+    names = {language: language_names.get(language, language)
+             for languages in batch.values() for language in languages}
+
+    system_message = """
+    You are a translator for an electronics company. \
+    Translate the text of every item in the json input into each \
+    of the languages listed for it. Keep product names, brands and \
+    model numbers unchanged and keep the layout of the text.
+    Respond only with a json object mapping the id of each item \
+    to an object that maps each language code to its translation, e.g.
+    {"0": {"es": "<translation>", "fr": "<translation>"}}
+    """
+
+    messages = [
+        {'role': 'system', 'content': system_message},
+        {'role': 'user', 'content': json.dumps({'language_names': names, 'items': items}, ensure_ascii=False)},
+    ]
+    return messages
+
+
+def single_translation_messages(text, language):
+    messages = [
+        {'role': 'system', 'content': text},
+        {'role': 'user', 'content': f"Translate the given content into {language_names.get(language, language)}. "
+                                    f"Respond with the translation only."},
+    ]
+    return messages
+
+
+def parse_translations(response):
+    try:
+        data = json.loads(response[response.index("{"):response.rindex("}") + 1])
+    except (ValueError, AttributeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class TranslationService:
+    """
+    Translates a list of texts into a list of languages. Cached pairs are
+    served from the translation cache, the others are sent together in as
+    few structured requests as the token budget allows. Pairs missing from
+    a structured answer are translated one by one.
+    """
+
+    def __init__(self, cache=translation_cache, max_tokens=max_request_tokens):
+        self.cache = cache
+        self.max_tokens = max_tokens
+
+    def lookup(self, texts, languages):
+        """Cached translations per text, and the (index, language) pairs still to translate."""
+        results = [{} for _ in texts]
+        missing = []
+        for index, text in enumerate(texts):
+            for language in languages:
+                if not text or language == "en":
+                    results[index][language] = text
+                    continue
+                translation = self.cache.get(translation_key(text, language))
+                if translation is None:
+                    missing.append((index, language))
+                else:
+                    results[index][language] = translation
+        return results, missing
+
+    def batches(self, texts, missing):
+        """Split the missing pairs into requests of at most max_tokens completion tokens."""
+        batches = []
+        batch, tokens = {}, 0
+        for index, language in missing:
+            cost = estimate_tokens(texts[index], language)
+            if batch and tokens + cost > self.max_tokens:
+                batches.append((batch, tokens))
+                batch, tokens = {}, 0
+            batch.setdefault(index, []).append(language)
+            tokens += cost
+        if batch:
+            batches.append((batch, tokens))
+        return batches
+
+    def store(self, texts, index, language, translation, results, max_tokens=None):
+        """Only complete translations are cached, a missing one falls back to the text."""
+        if not isinstance(translation, str) or not translation.strip():
+            print(f"No translation into {language}, keeping the original text")
+            results[index][language] = texts[index]
+            return
+        results[index][language] = translation
+        if max_tokens is not None and truncated(translation, max_tokens):
+            print(f"Translation into {language} reached its {max_tokens} token limit, not caching it")
+            return
+        self.cache.set(translation_key(texts[index], language), translation)
+
+    def apply(self, response, texts, batch, results):
+        """Store the translations of a structured answer, returning the pairs it lacks."""
+        translations = parse_translations(response)
+        failed = []
+        for index, languages in batch.items():
+            for language in languages:
+                translation = translations.get(str(index), {})
+                translation = translation.get(language) if isinstance(translation, dict) else None
+                if isinstance(translation, str) and translation.strip():
+                    self.store(texts, index, language, translation, results)
+                else:
+                    failed.append((index, language))
+        if failed:
+            print(f"Structured translation lacked {len(failed)} of the requested translations")
+        return failed
+
+    def translate(self, texts, languages, complete):
+        """
+        Returns one {language: translation} dict per text.
+        complete(messages, max_tokens=...) returns the content of a chat completion.
+        """
+        results, missing = self.lookup(texts, languages)
+        for batch, tokens in self.batches(texts, missing):
+            response = complete(batch_translation_messages(texts, batch), max_tokens=tokens + 50)
+            for index, language in self.apply(response, texts, batch, results):
+                max_tokens = estimate_tokens(texts[index], language)
+                translation = complete(single_translation_messages(texts[index], language),
+                                       max_tokens=max_tokens)
+                self.store(texts, index, language, translation, results, max_tokens)
+        return results
+
+    async def atranslate(self, texts, languages, complete):
+        """Async version of translate, the requests of the batches run concurrently."""
+        results, missing = self.lookup(texts, languages)
+
+        async def run(batch, tokens):
+            response = await complete(batch_translation_messages(texts, batch), max_tokens=tokens + 50)
+            for index, language in self.apply(response, texts, batch, results):
+                max_tokens = estimate_tokens(texts[index], language)
+                translation = await complete(single_translation_messages(texts[index], language),
+                                             max_tokens=max_tokens)
+                self.store(texts, index, language, translation, results, max_tokens)
+
+        await asyncio.gather(*[run(batch, tokens) for batch, tokens in self.batches(texts, missing)])
+        return results
+
+
+translation_service = TranslationService()
@@ -18,25 +18,20 @@ load_dotenv(find_dotenv())
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 # ## Step 1: Load PDF Documents
-# Load multiple PDF documents using `PyPDFLoader`. Here, a few duplicate documents are added to simulate messy data.
+# List the PDF documents to index. Here, a few duplicate documents are added to simulate messy data.
+# The documents are loaded with `PyPDFLoader` in Step 4, and only when they changed since the last run.
 
-from langchain_community.document_loaders import PyPDFLoader # type: ignore
-
-pdf_loaders = [
+pdf_paths = [
     # Duplicate documents on purpose - messy data
-    PyPDFLoader("docs/cs229_lectures/sfbu-2024-2025-university-catalog-8-20-2024_1.pdf"),
-    PyPDFLoader("docs/cs229_lectures/sfbu-2024-2025-university-catalog-8-20-2024_3.pdf"),
-    PyPDFLoader("docs/cs229_lectures/sfbu-2024-2025-university-catalog-8-20-2024_1.pdf"),
-    PyPDFLoader("docs/cs229_lectures/sfbu-2024-2025-university-catalog-8-20-2024_2.pdf")
+    "docs/cs229_lectures/sfbu-2024-2025-university-catalog-8-20-2024_1.pdf",
+    "docs/cs229_lectures/sfbu-2024-2025-university-catalog-8-20-2024_3.pdf",
+    "docs/cs229_lectures/sfbu-2024-2025-university-catalog-8-20-2024_1.pdf",
+    "docs/cs229_lectures/sfbu-2024-2025-university-catalog-8-20-2024_2.pdf"
 ]
 
-# Load all documents into `docs` list
-docs = []
-for loader in pdf_loaders:
-    docs.extend(loader.load())
-
 # ## Step 2: Split Documents into Chunks
 # Use `RecursiveCharacterTextSplitter` to divide each document into smaller, semantically meaningful chunks for embedding.
+# Every page is split on its own, so a change to one page only changes the chunks of that page.
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter # type: ignore
 
@@ -45,10 +40,6 @@ text_splitter = RecursiveCharacterTextSplitter(
     chunk_overlap = 150      # Overlap between chunks to retain context
 )
 
-splits = text_splitter.split_documents(docs)
-
-print(f"Total number of chunks: {len(splits)}")
-
 # ## Step 3: Embed Each Chunk
 # Embed each document chunk to create vectors for similarity search.
 
@@ -73,25 +64,28 @@ print("Similarity between sentence2 and sentence3:", np.dot(embedding2, embeddin
 
 # ## Step 4: Store Embeddings in a Vector Store
 # Set up a vector store (Chroma) to store embeddings for document retrieval.
+# The store is updated incrementally: only new or changed chunks are embedded and
+# chunks removed from the documents are deleted (see incremental_index.py).
 
 # Install chromadb package if not already installed
 # !pip install chromadb
 
 from langchain_community.vectorstores import Chroma # type: ignore
+from incremental_index import update_index
 
 # Set directory for persistent storage of vector database
 persist_directory = 'docs/chroma/'
 
-# Remove old database files if present to avoid conflicts
-os.system('rm -rf ./docs/chroma')
-
-# Create vector store from document chunks
-vectordb = Chroma.from_documents(
-    documents = splits,
-    embedding = embedding,
-    persist_directory = persist_directory
+# Open the existing vector store, then embed only what changed since the last run
+vectordb = Chroma(
+    persist_directory = persist_directory,
+    embedding_function = embedding
 )
 
+index_stats = update_index(vectordb, pdf_paths, text_splitter, persist_directory)
+print(f"\nIndexed {index_stats['files']} files in {index_stats['seconds']}s: {index_stats['reloaded']} reloaded, "
+      f"{index_stats['embedded']} chunks embedded, {index_stats['kept']} unchanged, {index_stats['deleted']} deleted")
+
 print("\nTotal documents in vector store:", vectordb._collection.count())
 
 # ## Step 5: Perform Similarity Search
@@ -0,0 +1,139 @@
+# Incremental indexing of the PDF documents into the Chroma vector store
+
+# Instead of deleting the vector store and embedding every chunk again, a
+# manifest next to the store keeps the content hash of every source file and
+# the ids of its chunks. The id of a chunk is the hash of its content, so:
+# 1. Unchanged files are not even loaded.
+# 2. Changed files are loaded and split again, but only chunks with new content are embedded.
+# 3. Chunks that disappeared from a file, and files removed from the list, are deleted from the store.
+#############################################################
+
+import hashlib
+import json
+import os
+import time
+
+from langchain_community.document_loaders import PyPDFLoader # type: ignore
+
+manifest_name = "index_manifest.json"
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_keys(paths):
+    """One key per entry of the list; a file listed twice gets a second, separate copy in the store."""
+    keys = []
+    for path in paths:
+        copies = sum(1 for key, _ in keys if key.split("#")[0] == path)
+        keys.append((f"{path}#{copies}" if copies else path, path))
+    return keys
+
+
+def chunk_ids(key, chunks):
+    """Content hash ids, numbered when the same text occurs more than once in a file."""
+    ids, seen = [], {}
+    for chunk in chunks:
+        chunk_id = hashlib.sha256(f"{key}\n{chunk.page_content}".encode("utf-8")).hexdigest()
+        seen[chunk_id] = seen.get(chunk_id, 0) + 1
+        ids.append(chunk_id if seen[chunk_id] == 1 else f"{chunk_id}-{seen[chunk_id]}")
+    return ids
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_manifest(path, manifest):
+    # Written to a temporary file first, so an interrupted run never leaves half a manifest
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def index_settings(text_splitter, embedding):
+    """Settings that change every chunk or every vector; a change rebuilds the whole index."""
+    return {
+        "chunk_size": text_splitter._chunk_size,
+        "chunk_overlap": text_splitter._chunk_overlap,
+        "embedding": getattr(embedding, "model", type(embedding).__name__),
+    }
+
+
+def update_index(vectordb, paths, text_splitter, persist_directory):
+    """
+    Brings the vector store up to date with the PDF files in `paths`.
+    Returns counts of the work done: files reloaded, chunks embedded,
+    kept and deleted.
+    """
+    started = time.perf_counter()
+    manifest_path = os.path.join(persist_directory, manifest_name)
+    settings = index_settings(text_splitter, vectordb.embeddings)
+    manifest = load_manifest(manifest_path)
+
+    if manifest is None or manifest.get("settings") != settings:
+        # A store without a manifest (or built with other settings) has ids that cannot be matched
+        stale = vectordb.get(include=[])["ids"]
+        if stale:
+            print(f"Rebuilding the index, deleting {len(stale)} vectors it cannot match")
+            vectordb.delete(ids=stale)
+        manifest = {"settings": settings, "sources": {}}
+
+    counts = {"files": 0, "reloaded": 0, "embedded": 0, "kept": 0, "deleted": 0}
+    sources = {}
+    for key, path in source_keys(paths):
+        counts["files"] += 1
+        digest = file_hash(path)
+        previous = manifest["sources"].get(key)
+        if previous and previous["sha256"] == digest:
+            sources[key] = previous
+            counts["kept"] += len(previous["ids"])
+            continue
+
+        # Step 1: Load and split only the files that changed
+        counts["reloaded"] += 1
+        chunks = text_splitter.split_documents(PyPDFLoader(path).load())
+        ids = chunk_ids(key, chunks)
+
+        # Step 2: Embed the chunks the store does not have yet
+        existing = set(vectordb.get(ids=ids, include=[])["ids"]) if ids else set()
+        new = [(chunk_id, chunk) for chunk_id, chunk in zip(ids, chunks) if chunk_id not in existing]
+        if new:
+            vectordb.add_documents([chunk for _, chunk in new], ids=[chunk_id for chunk_id, _ in new])
+        kept = [(chunk_id, chunk) for chunk_id, chunk in zip(ids, chunks) if chunk_id in existing]
+        if kept:
+            # Unchanged text can move to another page, the metadata is updated without embedding it again
+            vectordb._collection.update(ids=[chunk_id for chunk_id, _ in kept],
+                                        metadatas=[chunk.metadata for _, chunk in kept])
+
+        # Step 3: Delete the chunks that are no longer in the file
+        removed = set(previous["ids"]) - set(ids) if previous else set()
+        if removed:
+            vectordb.delete(ids=list(removed))
+
+        counts["embedded"] += len(new)
+        counts["kept"] += len(kept)
+        counts["deleted"] += len(removed)
+        sources[key] = {"path": path, "sha256": digest, "ids": ids}
+        print(f"{key}: {len(new)} chunks embedded, {len(kept)} unchanged, {len(removed)} deleted")
+
+    # Files that were removed from the list
+    for key, source in manifest["sources"].items():
+        if key not in sources and source["ids"]:
+            vectordb.delete(ids=source["ids"])
+            counts["deleted"] += len(source["ids"])
+            print(f"{key}: removed, {len(source['ids'])} chunks deleted")
+
+    manifest["sources"] = sources
+    save_manifest(manifest_path, manifest)
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    return counts